@@ -4,228 +4,385 @@ import pandas as pd
 from dash import dcc, html, callback_context
 from dash.dash_table import DataTable
 from dash.dependencies import Output, Input, State
+from flask import Response, jsonify, request
 import plotly.express as px
-import spacy
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from gliner_spacy.pipeline import GlinerSpacy
-import warnings
 import os
-import gc
+import gzip
+import zlib
 import logging
+import re
+import uuid
+import argparse
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import csv
+import io
+from itertools import chain, islice
+from collections import OrderedDict
+
+# Models, caches and the keyword pipeline live in keyword_pipeline so the CLI and
+# benchmarks can run without the dashboard. Module-level model state (nlp,
+# sentence_model, warmup_error) is read through the module so it stays current.
+import keyword_pipeline
+from keyword_pipeline import (
+    batch_process_keywords,
+    map_cached_category_embeddings,
+    merge_processed_data,
+    models_ready,
+    preload_category_embeddings,
+    start_warmup,
+    stream_process_keywords,
+)
+# Stored job results are pickled, so their classes live in a plain module rather
+# than here: unpickling them must not import the Dash app
+from results import RESULT_COLUMNS, KeywordResultTable, ResultStore
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Suppress specific warnings
-warnings.filterwarnings("ignore", message="The sentencepiece tokenizer")
+
+# Keyword analysis jobs run on Celery workers when REDIS_URL is set, otherwise on a
+# thread pool in the web process (see KeywordJobQueue)
+if os.environ.get('REDIS_URL'):
+    from celery import Celery
+    celery_app = Celery(__name__, broker=os.environ['REDIS_URL'], backend=os.environ['REDIS_URL'])
+else:
+    celery_app = None
 
 # Initialize Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY, 'https://use.fontawesome.com/releases/v5.8.1/css/all.css'])
 server = app.server
 
-# Reference absolute file path 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CATEGORIES_FILE = os.path.join(BASE_DIR, 'google_categories.txt')
-
-# Configuration for GLiNER integration
-custom_spacy_config = {
-    "gliner_model": "urchade/gliner_small-v2.1",
-    "chunk_size": 128,
-    "labels": ["person", "organization", "location", "event", "work_of_art", "product", "service", "date", "number", "price", "address", "phone_number", "misc"],
-    "threshold": 0.5
+# Rows per page of the keyword table
+TABLE_PAGE_SIZE = 25
+
+# Maximum keywords accepted from the dashboard per submit (0 = no limit)
+MAX_KEYWORDS = int(os.environ.get('KEYINTENT_MAX_KEYWORDS', '0'))
+
+# JSON API limits
+API_MAX_KEYWORDS = int(os.environ.get('KEYINTENT_API_MAX_KEYWORDS', '1000'))
+API_GZIP_MIN_BYTES = 1024
+
+# Keywords from an uploaded .txt (one per line) or .csv (first column) file
+def iter_uploaded_keywords(contents, filename):
+    _, encoded = contents.split(',', 1)
+    text = io.TextIOWrapper(io.BytesIO(base64.b64decode(encoded)), encoding='utf-8', errors='replace')
+    if filename and filename.lower().endswith('.csv'):
+        for i, row in enumerate(csv.reader(text)):
+            if not row or (i == 0 and row[0].strip().lower() in ('keyword', 'keywords')):
+                continue
+            yield row[0]
+    else:
+        for line in text:
+            yield line
+
+# DataTable filter operators supported server-side, mapped to query() operators
+FILTER_OPERATORS = {
+    'contains': 'contains', 'icontains': 'contains', 'scontains': 'contains',
+    '=': 'eq', 'eq': 'eq', 'i=': 'eq', 's=': 'eq', 'ieq': 'eq', 'seq': 'eq',
+    '!=': 'ne', 'ne': 'ne', 'i!=': 'ne', 's!=': 'ne', 'ine': 'ne', 'sne': 'ne',
 }
 
-# Model variables for lazy loading
-nlp = None
-sentence_model = None
-google_categories = []
+# Split a filter_query into clauses on '&&', ignoring '&&' inside quoted values
+def split_filter_query(filter_query):
+    clauses, current, quote = [], [], None
+    i = 0
+    while i < len(filter_query):
+        char = filter_query[i]
+        if quote:
+            current.append(char)
+            if char == '\\' and i + 1 < len(filter_query):
+                current.append(filter_query[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'`':
+            quote = char
+            current.append(char)
+        elif filter_query.startswith('&&', i):
+            clauses.append(''.join(current))
+            current = []
+            i += 1
+        else:
+            current.append(char)
+        i += 1
+    clauses.append(''.join(current))
+    return [clause.strip() for clause in clauses if clause.strip()]
+
+# Parse a DataTable filter_query such as '{Keywords} contains "shoes" && {NER Entities} != x'.
+# Raises ValueError for a clause that can't be applied, rather than dropping it.
+def parse_filter_query(filter_query):
+    filters = []
+    for clause in split_filter_query(filter_query or ''):
+        match = re.match(r'^\{(.+?)\}\s+(\S+)\s+(.*)$', clause)
+        if not match or match.group(2) not in FILTER_OPERATORS or match.group(1) not in RESULT_COLUMNS:
+            raise ValueError(f"Unsupported filter: {clause}")
+        column, operator, value = match.groups()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        filters.append((column, FILTER_OPERATORS[operator], value))
+    return filters
+
+# Finished jobs, shared with Celery workers through the disk tier
+result_store = ResultStore()
+
+# Result for the job reference held in dcc.Store, or None if there is none (or it expired)
+def get_job_result(job):
+    if not job:
+        return None
+    return result_store.get(job.get('job_id'))
+
+# Worker threads for keyword analysis jobs in the web process, and how many finished
+# jobs are kept for the dashboard to poll
+JOB_WORKERS = int(os.environ.get('KEYINTENT_JOB_WORKERS', '1'))
+JOB_HISTORY_SIZE = 256
 
-# Function to lazy load NLP model
-def get_nlp():
-    global nlp
-    if nlp is None:
-        try:
-            logger.info("Loading spaCy model")
-            nlp = spacy.blank("en")
-            nlp.add_pipe("gliner_spacy", config=custom_spacy_config)
-            logger.info("spaCy model loaded successfully")
-        except Exception as e:
-            logger.exception("Error loading spaCy model")
-            raise
-    return nlp
-
-# Function to lazy load sentence transformer model
-def get_sentence_model():
-    global sentence_model
-    if sentence_model is None:
-        sentence_model = SentenceTransformer('all-MiniLM-L6-v2')
-    return sentence_model
-
-# Load Google's content categories
-def load_google_categories():
-    global google_categories
-    if not google_categories:
+# One keyword analysis job: stream the keywords through the pipeline, store the result
+# server-side and return its ID with a summary message
+def run_keyword_job(keywords, progress_callback=None):
+    processed_data = {'Keywords': [], 'Intent': [], 'NER Entities': [], 'Google Content Topics': []}
+    stats = {}
+    for chunk in stream_process_keywords(keywords, progress_callback=progress_callback, stats=stats, collect_garbage=True):
+        merge_processed_data(processed_data, chunk)
+    logger.info(f"Request stats: {stats}")
+
+    job_id = result_store.put(KeywordResultTable(processed_data, stats=stats))
+    message = "Keyword processing complete!"
+    if stats.get('keywords'):
+        message += f" {stats['keywords']} keywords, {stats['unique_keywords']} unique ({stats['dedup_ratio']:.0%} duplicates)."
+    return {'job_id': job_id, 'message': message}
+
+# Keyword analysis jobs on a long-lived thread pool in the web process. Models load
+# once per process and the in-process caches (keyword results, category matrix,
+# result store) survive between jobs; torch releases the GIL during inference.
+class KeywordJobQueue:
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY_SIZE):
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='keyword-job')
+        self._tasks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, keywords):
+        task_id = uuid.uuid4().hex
+        self._update(task_id, state='queued', done=0)
+        self._executor.submit(self._run, task_id, keywords)
+        return task_id
+
+    def status(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def _run(self, task_id, keywords):
+        self._update(task_id, state='running')
         try:
-            with open(CATEGORIES_FILE, 'r') as f:
-                google_categories = [line.strip() for line in f]
+            result = run_keyword_job(keywords, progress_callback=lambda done: self._update(task_id, done=done))
+            self._update(task_id, state='done', result=result)
         except Exception as e:
-            google_categories = []
-    return google_categories
-
-# Function to perform NER using GLiNER with spaCy
-def perform_ner(text):
-    try:
-        doc = get_nlp()(text)
-        return [(ent.text, ent.label_) for ent in doc.ents]
-    except Exception as e:
-        return []
-
-# Function to extract entities using GLiNER with spaCy
-def extract_entities(text):
-    try:
-        doc = get_nlp()(text)
-        entities = [(ent.text, ent.label_) for ent in doc.ents]
-        return entities if entities else ["No specific entities found"]
-    except Exception as e:
-        return ["Error extracting entities"]
-
-# Function to precompute category embeddings
-def compute_category_embeddings():
+            logger.exception("Keyword analysis job failed")
+            self._update(task_id, state='error', error=str(e))
+
+    def _update(self, task_id, **fields):
+        with self._lock:
+            self._tasks.setdefault(task_id, {}).update(fields)
+            # Forget the oldest finished jobs; queued and running ones are always kept
+            finished = [key for key, task in self._tasks.items() if task['state'] in ('done', 'error')]
+            for key in finished[:max(0, len(self._tasks) - self.history)]:
+                del self._tasks[key]
+
+# The same jobs on Celery workers, with progress reported through the task state.
+# Prefork worker processes are long-lived too: each loads the models on its first job.
+class CeleryKeywordJobQueue:
+    def submit(self, keywords):
+        return analyze_keywords_task.delay(keywords).id
+
+    def status(self, task_id):
+        result = celery_app.AsyncResult(task_id)
+        if result.state == 'PROGRESS':
+            return {'state': 'running', 'done': result.info.get('done', 0)}
+        if result.state == 'SUCCESS':
+            return {'state': 'done', 'result': result.result}
+        if result.state == 'FAILURE':
+            return {'state': 'error', 'error': str(result.result)}
+        return {'state': 'queued', 'done': 0}
+
+if celery_app is not None:
+    @celery_app.task(bind=True, name='keyintent.analyze_keywords')
+    def analyze_keywords_task(self, keywords):
+        return run_keyword_job(keywords, progress_callback=lambda done: self.update_state(state='PROGRESS', meta={'done': done}))
+
+    keyword_jobs = CeleryKeywordJobQueue()
+else:
+    keyword_jobs = KeywordJobQueue()
+
+# Liveness probe: the process is up and serving
+@server.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
+
+# Readiness probe: 200 only once warmup has finished
+@server.route('/readyz')
+def readyz():
+    if models_ready.is_set():
+        return jsonify(status='ready')
+    if keyword_pipeline.warmup_error:
+        return jsonify(status='error', error=keyword_pipeline.warmup_error), 503
+    return jsonify(status='warming up'), 503
+
+# JSON response, gzip-compressed when the client accepts it and the body is large enough to benefit
+def json_response(payload, status=200):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'Vary': 'Accept-Encoding'}
+    if len(body) >= API_GZIP_MIN_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = gzip.compress(body, compresslevel=5)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, status=status, headers=headers)
+
+# JSON API: POST {"keywords": [...], "batch_size": 8} and get intent, entities and
+# topics per keyword. Shares the warmed models and result cache with the dashboard.
+@server.route('/api/v1/analyze', methods=['POST'])
+def analyze_api():
+    if not models_ready.is_set():
+        return json_response({'error': 'models are still loading'}, 503)
+
+    payload = request.get_json(silent=True)
+    keywords = payload.get('keywords') if isinstance(payload, dict) else None
+    if not isinstance(keywords, list) or not keywords:
+        return json_response({'error': '"keywords" must be a non-empty list of strings'}, 400)
+    if len(keywords) > API_MAX_KEYWORDS:
+        return json_response({'error': f'at most {API_MAX_KEYWORDS} keywords per request'}, 413)
+    if not all(isinstance(kw, str) and kw.strip() for kw in keywords):
+        return json_response({'error': 'keywords must be non-empty strings'}, 400)
     try:
-        categories = load_google_categories()
-        return get_sentence_model().encode(categories)
-    except Exception as e:
-        return []
-
-# Function to perform topic modeling using sentence transformers
-def perform_topic_modeling_from_similarities(similarities):
-    try:
-        categories = load_google_categories()
-        top_indices = similarities.argsort()[-3:][::-1]
-        
-        best_match = categories[top_indices[0]]
-        second_best = categories[top_indices[1]]
-        
-        if similarities[top_indices[0]] > similarities[top_indices[1]] * 1.1:
-            return best_match
-        else:
-            return f"{best_match} , {second_best}"
-    except Exception as e:
-        return "Error in topic modeling"
-
-# Function to sort keywords by intent feature
-def sort_by_keyword_feature(f):
-    if type(f) != str:
-        return "other"
-    f = f.lower()
-
-    informational_keywords = [
-        "advice", "help", "how do i", "how does", "how to", "ideas", "information", "tools", "list", 
-        "resources", "tips", "tutorial", "diy", "ways to", "what does", "what is", "what was", "where are", "where does", 
-        "where can", "where is", "where was", "when is", "when are", "when was", "where to", "who is", "who said", "who wrote", 
-        "who are", "why are", "who was", "why is", "examples", "explained", "meaning of", "definition", "benefits of", "uses of", 
-        "overview", "summary", "report", "study",  "analysis", "research", "insight", "data", "facts", "details", "background", 
-        "context", "news", "history", "documentation", "article", "paper", "blog", "forum", "discussion", "commentary", 
-        "opinion", "perspective", "viewpoint", "guide", "difference between", "types of"
-    ]
-
-    navigational_keywords = [
-        "facebook", "meta", "twitter", "site", "login", "account", "official website", "homepage", "portal", 
-        "signin", "register", "signup", "dashboard", "profile", "settings", "control panel", "main page", 
-        "user area", "admin", "control", "access", "entry", "webpage", "navigate", "home", "site map", 
-        "directory", "find", "search", "lookup", "index", "online", "internet", "web", "browser", "navigate to", 
-        "goto", "landing page", "url", "hyperlink", "link", "web address", "navigate", 
-        "web navigation", "website address", "app", "download", "status", "join"
-    ]
-
-    local_keywords = [
-        "closest", "close", "near me", "my area", "residential", "my zip", "my city", "nearby", "in town", 
-        "around here", "local", "near", "vicinity", "local area", "nearest", "surrounding", "within miles", 
-        "in my neighborhood", "district", "zone", "region", "near my location", "local services", "community", 
-        "local shop", "in my vicinity", "local store", "suburb", "urban area", "within walking distance", 
-        "around my place", "within my reach", "close by", "local office", "local branch", "near me now", 
-        "in my locale", "within the city", "local market", "in my town", "local spot", "local point", 
-        "local guide", "near my house", "local venue", "close to me", "within blocks", "local attractions", 
-        "local events", "address"
-    ]
-
-    commercial_keywords = [
-        "best", "affordable", "budget", "cheap", "expensive", "review", "top", "service", "cost", "average cost", 
-        "calculator", "provider", "company", "vs", "companies", "professional", "specialist", "compare", 
-        "comparison", "rating", "testimonials", "recommendation", "advisor", "consultant", "expert", "ranking", 
-        "leader", "top-rated", "best-selling", "trending", "featured", "highlighted", "recommended", "popular", 
-        "favorite", "preferred", "choice", "most reviewed", "highest rated", "highly recommended", "award-winning", 
-        "five-star", "customer favorite", "top pick", "critically acclaimed", "editor's choice", "people's choice", 
-        "top performer", "best value", "best overall", "best quality", "best price", "most trusted", "leading brand", 
-        "popular choice", "most popular", "fees", "pros and cons"
+        batch_size = min(max(int(payload.get('batch_size', 8)), 1), 128)
+    except (TypeError, ValueError):
+        return json_response({'error': '"batch_size" must be an integer'}, 400)
+
+    stats = {}
+    processed_data = batch_process_keywords([kw.strip() for kw in keywords], batch_size=batch_size, stats=stats, structured=True)
+    if len(processed_data['Keywords']) != len(keywords):
+        return json_response({'error': 'keyword processing failed'}, 500)
+
+    rows = list(zip(processed_data['Keywords'], processed_data['Intent'],
+                    processed_data['NER Entities'], processed_data['Google Content Topics']))
+    # Failed keywords are not cached, so retrying the request only reprocesses those
+    failed = [keyword for keyword, _, entities, topics in rows if entities is None or topics is None]
+    if failed:
+        return json_response({'error': f'entity or topic extraction failed for {len(failed)} keywords', 'failed': failed}, 500)
+
+    results = [
+        {'keyword': keyword, 'intent': intent, 'entities': [{'text': text, 'label': label} for text, label in entities], 'topics': topics}
+        for keyword, intent, entities, topics in rows
     ]
+    return json_response({'results': results, 'stats': stats})
+
+# Rows per chunk written by the streamed exports
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_FILENAME = "KeyIntentNER-T_keyword_analysis"
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+}
 
-    transactional_keywords = [
-        "price", "quotes", "pricing", "purchase", "rates", "how much", "same day", "same-day", "buy", "order", 
-        "discount", "deal", "offers", "sale", "checkout", "book", "reservation", "reserve", "bargain", "coupon", 
-        "promo", "rebate", "clearance", "markdown", "buy one get one", "bogo", "special", "exclusive", "bundle", 
-        "package", "subscription", "membership", "payment", "installment", "financing", "contract", "billing", 
-        "invoice", "ticket", "admission", "entry", "enrollment", "register", "sign up", "pre-order", "e-commerce", 
-        "shopping cart"
-    ]
+# CSV export, encoded one chunk of rows at a time
+def iter_result_csv(result, chunk_rows=EXPORT_CHUNK_ROWS):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(RESULT_COLUMNS)
+    for start in range(0, len(result), chunk_rows):
+        writer.writerows(zip(*(result.columns[name][start:start + chunk_rows] for name in RESULT_COLUMNS)))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+# Gzip the CSV stream incrementally (wbits=31 writes a gzip header and trailer)
+def iter_result_csv_gz(result, chunk_rows=EXPORT_CHUNK_ROWS):
+    compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+    for data in iter_result_csv(result, chunk_rows):
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Write-only sink that hands back whatever pyarrow has written since the last drain
+class ExportSink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+# Parquet export, one row group per chunk of rows
+def iter_result_parquet(result, chunk_rows=EXPORT_CHUNK_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(name, pa.string()) for name in RESULT_COLUMNS])
+    sink = ExportSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for start in range(0, len(result), chunk_rows):
+            chunk = {name: result.columns[name][start:start + chunk_rows].tolist() for name in RESULT_COLUMNS}
+            writer.write_table(pa.Table.from_pydict(chunk, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+EXPORT_WRITERS = {
+    'csv': iter_result_csv,
+    'csv.gz': iter_result_csv_gz,
+    'parquet': iter_result_parquet,
+}
 
-    if any(keyword in f for keyword in informational_keywords):
-        return "informational"
-    if any(keyword in f for keyword in navigational_keywords):
-        return "navigational"
-    if any(keyword in f for keyword in local_keywords):
-        return "local"
-    if any(keyword in f for keyword in commercial_keywords):
-        return "commercial investigation"
-    if any(keyword in f for keyword in transactional_keywords):
-        return "transactional"
-
-    return "other"
-
-# Optimized batch processing of keywords
-def batch_process_keywords(keywords, batch_size=8):
-    processed_data = {'Keywords': [], 'Intent': [], 'NER Entities': [], 'Google Content Topics': []}
-    
-    try:
-        sentence_model = get_sentence_model()
-        category_embeddings = compute_category_embeddings()
-        
-        for i in range(0, len(keywords), batch_size):
-            logger.info(f"Processing {len(keywords)} keywords")
-            batch = keywords[i:i+batch_size]
-            logger.info(f"Processing batch {i//batch_size + 1}")
-            batch_embeddings = sentence_model.encode(batch, batch_size=batch_size, show_progress_bar=False)
-            
-            intents = [sort_by_keyword_feature(kw) for kw in batch]
-            entities = [extract_entities(kw) for kw in batch]
-            
-            similarities = cosine_similarity(batch_embeddings, category_embeddings)
-            Google_Content_Topics = [perform_topic_modeling_from_similarities(sim) for sim in similarities]
-            
-            processed_data['Keywords'].extend(batch)
-            processed_data['Intent'].extend(intents)
-            
-            processed_entities = []
-            for entity_list in entities:
-                entity_strings = []
-                for entity in entity_list:
-                    if isinstance(entity, tuple):
-                        entity_strings.append(f"{entity[0]} ({entity[1]})")
-                    else:
-                        entity_strings.append(str(entity))
-                processed_entities.append(", ".join(entity_strings))
-            
-            processed_data['NER Entities'].extend(processed_entities)
-            processed_data['Google Content Topics'].extend(Google_Content_Topics)
-            
-            # Force garbage collection
-            gc.collect()
-        logger.info("Keyword processing completed successfully")
-    except Exception as e:
-        logger.exception("An error occurred in batch_process_keywords")
-    
-    return processed_data
+# Streamed download of a finished job: /download/<job_id>.csv, .csv.gz or .parquet.
+# Rows are encoded chunk by chunk from the result store, so memory use does not
+# grow with the size of the export. The job ID is pinned to 32 characters because the
+# default converter accepts dots and would split "<id>.csv.gz" as "<id>.csv" + "gz".
+@server.route('/download/<string(length=32):job_id>.<path:fmt>')
+def download_result(job_id, fmt):
+    if fmt not in EXPORT_WRITERS:
+        return json_response({'error': f'unsupported format, use one of: {", ".join(EXPORT_WRITERS)}'}, 404)
+    result = result_store.get(job_id)
+    if result is None:
+        return json_response({'error': 'unknown or expired job'}, 404)
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return json_response({'error': 'Parquet export needs pyarrow'}, 501)
+
+    headers = {'Content-Disposition': f'attachment; filename="{EXPORT_FILENAME}.{fmt}"'}
+    return Response(EXPORT_WRITERS[fmt](result), mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+# Each process loads its own models: a process that has run torch is never forked,
+# because forking after torch's OpenMP thread pool has started can deadlock the
+# child. With KEYINTENT_WARMUP=1 this process warms up in the background while
+# /readyz reports 503; without it, models load lazily on first use.
+# KEYINTENT_PRELOAD_EMBEDDINGS=1 only memory-maps an existing category embeddings
+# cache, so gunicorn --preload workers share its pages; it never encodes.
+if os.environ.get('KEYINTENT_WARMUP') == '1':
+    start_warmup()
+elif os.environ.get('KEYINTENT_PRELOAD_EMBEDDINGS') == '1':
+    if map_cached_category_embeddings() is None:
+        logger.info("No category embeddings cache to preload; it will be built on first use")
+    models_ready.set()
+else:
+    models_ready.set()
 
 # Main layout of the dashboard
 app.layout = dbc.Container([
@@ -246,11 +403,19 @@ app.layout = dbc.Container([
 
     dbc.Row([
         dbc.Col([
-            dbc.Label('Enter keywords (one per line, maximum of 100):', className='text-light'),
+            dbc.Label('Enter keywords (one per line) or upload a .txt/.csv file:', className='text-light'),
             dcc.Textarea(id='keyword-input', value='', style={'width': '100%', 'height': 100}),
+            dcc.Upload(
+                id='keyword-upload',
+                children=html.Div(['Drag and drop or ', html.A('select a keyword file', className='text-info')]),
+                accept='.txt,.csv',
+                style={'width': '100%', 'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px', 'textAlign': 'center', 'padding': '10px'},
+                className='text-light mb-3'
+            ),
             dbc.Button('Submit', id='submit-button', color='primary', className='mb-3', disabled=True),
             dbc.Alert(id='alert', is_open=False, duration=4000, color='danger', className='my-2'),
             dbc.Alert(id='processing-alert', is_open=False, color='info', className='my-2'),
+            dbc.Progress(id='progress-bar', value=0, label='', striped=True, animated=True, className='my-2', style={'visibility': 'hidden'}),
         ], width=6)
     ], justify='center'),
     
@@ -279,17 +444,44 @@ app.layout = dbc.Container([
     ], justify='center'),
 
     dbc.Row(dbc.Col(
-        html.Div(id='keywords-table', style={'width': '100%'}),
+        html.Div(
+            DataTable(
+                id='keywords-datatable',
+                columns=[{"name": i, "id": i} for i in RESULT_COLUMNS],
+                data=[],
+                style_table={'overflowX': 'auto'},
+                style_cell={'textAlign': 'left', 'whiteSpace': 'normal', 'height': 'auto', 'minWidth': '100px', 'width': '100px', 'maxWidth': '100px'},
+                style_header={'backgroundColor': 'rgb(30, 30, 30)', 'color': 'white'},
+                style_data={'backgroundColor': 'rgb(50, 50, 50)', 'color': 'white'},
+                style_filter={'backgroundColor': 'rgb(40, 40, 40)', 'color': 'white'},
+                # Paging, sorting and filtering run server-side; only one page is sent
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='single',
+                filter_action='custom',
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                sort_by=[],
+                filter_query=''
+            ),
+            id='keywords-table', style={'width': '100%', 'display': 'none'}
+        ),
         width=12
     )),
 
-    dbc.Row(dbc.Col(
-        dbc.Button('Download CSV For All Keywords', id='download-button', color='success', className='my-5', disabled=True),
-        width=12
-    ), justify='center'),
+    dbc.Row(dbc.Col(html.Div(id='table-filter-warning', className='text-warning mt-2'), width=12)),
+
+    dbc.Row(dbc.Col([
+        dbc.Button('Download CSV For All Keywords', id='download-button', color='success', className='my-5', disabled=True, external_link=True),
+        html.Div([
+            html.A('CSV (gzip)', id='download-csv-gz-link', className='text-light me-3'),
+            html.A('Parquet', id='download-parquet-link', className='text-light'),
+        ], id='download-links', className='mb-5', style={'display': 'none'}),
+    ], width=12), justify='center'),
 
-    dcc.Download(id='download'),
     dcc.Store(id='processed-data'),
+    dcc.Store(id='keyword-task'),
+    dcc.Interval(id='job-poll', interval=1000, disabled=True),
 
 # Explanation content
     dbc.Row([
@@ -388,61 +580,105 @@ app.layout = dbc.Container([
 
 ], fluid=True)
 
+# Model status on page load. A plain callback: it only reads state and never queues a job
 @app.callback(
     [Output('models-loaded', 'data'),
      Output('submit-button', 'disabled'),
      Output('alert', 'is_open'),
      Output('alert', 'children'),
-     Output('alert', 'color'),
-     Output('processed-data', 'data'),
-     Output('loading-output', 'children'),
-     Output('processing-alert', 'is_open'),
-     Output('processing-alert', 'children')],
-    [Input('models-loaded', 'data'),
-     Input('submit-button', 'n_clicks')],
-    [State('keyword-input', 'value')]
+     Output('alert', 'color')],
+    [Input('models-loaded', 'data')]
 )
-def combined_callback(loaded, n_clicks, keyword_input):
-    ctx = callback_context
-    triggered_id = ctx.triggered[0]['prop_id'].split('.')[0]
-
-    try:
-        if triggered_id == 'models-loaded':
-            return handle_model_loading(loaded)
-        elif triggered_id == 'submit-button':
-            return handle_keyword_processing(n_clicks, keyword_input)
-        else:
-            return loaded, False, False, "", "success", None, '', False, ''
-    except Exception as e:
-        logger.exception("An error occurred in combined_callback")
-        return loaded, False, True, f"An error occurred: {str(e)}", "danger", None, '', False, ''
-
 def handle_model_loading(loaded):
     if not loaded:
         try:
+            if keyword_pipeline.warmup_error:
+                return False, True, True, f"Error loading models: {keyword_pipeline.warmup_error}", "danger"
+            if keyword_pipeline.nlp is not None and keyword_pipeline.sentence_model is not None:
+                return True, False, True, "Models loaded", "success"
             # Lazy loading will occur when models are first used
-            return True, False, True, "Models ready to load", "success", None, '', False, ''
+            return True, False, True, "Models ready to load", "success"
         except Exception as e:
-            return False, True, True, f"Error preparing models: {str(e)}", "danger", None, '', False, ''
-    return loaded, not loaded, False, "", "success", None, '', False, ''
-
-def handle_keyword_processing(n_clicks, keyword_input):
-    if n_clicks is None or not keyword_input:
-        return True, False, False, "", "success", None, '', False, ''
-
-    keywords = [kw.strip() for kw in keyword_input.split('\n')[:100] if kw.strip()]
-    processed_data = batch_process_keywords(keywords)
+            return False, True, True, f"Error preparing models: {str(e)}", "danger"
+    return loaded, not loaded, False, "", "success"
+
+# Keywords from the textarea plus an optional uploaded file, capped at MAX_KEYWORDS
+def read_submitted_keywords(keyword_input, upload_contents=None, upload_filename=None):
+    keywords = (keyword_input or '').split('\n')
+    if upload_contents:
+        keywords = chain(keywords, iter_uploaded_keywords(upload_contents, upload_filename))
+    if MAX_KEYWORDS:
+        keywords = islice(keywords, MAX_KEYWORDS)
+    # Keyword strings are small; materializing them gives the progress bar a total
+    return [kw.strip() for kw in keywords if kw.strip()]
+
+# Submit: queue a keyword analysis job; the dashboard then polls it for progress. The
+# upload is cleared once queued so later submits don't silently reprocess the same file.
+@app.callback(
+    [Output('keyword-task', 'data'),
+     Output('keyword-upload', 'contents'),
+     Output('keyword-upload', 'filename'),
+     Output('alert', 'is_open', allow_duplicate=True),
+     Output('alert', 'children', allow_duplicate=True),
+     Output('alert', 'color', allow_duplicate=True)],
+    [Input('submit-button', 'n_clicks')],
+    [State('keyword-input', 'value'),
+     State('keyword-upload', 'contents'),
+     State('keyword-upload', 'filename')],
+    prevent_initial_call=True
+)
+def submit_keywords(n_clicks, keyword_input, upload_contents, upload_filename):
+    try:
+        keywords = read_submitted_keywords(keyword_input, upload_contents, upload_filename)
+        if not keywords:
+            return dash.no_update, None, None, True, "Enter or upload at least one keyword", "warning"
+        task_id = keyword_jobs.submit(keywords)
+    except Exception as e:
+        logger.exception("An error occurred while submitting keywords")
+        return dash.no_update, None, None, True, f"An error occurred: {str(e)}", "danger"
+    return {'task_id': task_id, 'total': len(keywords)}, None, None, False, "", "success"
 
-    return True, False, False, "", "success", processed_data, '', True, "Keyword processing complete!"
+# Poll the queued job for per-batch progress; once it finishes, publish the result ID
+@app.callback(
+    [Output('progress-bar', 'value'),
+     Output('progress-bar', 'label'),
+     Output('progress-bar', 'style'),
+     Output('job-poll', 'disabled'),
+     Output('submit-button', 'disabled', allow_duplicate=True),
+     Output('processed-data', 'data'),
+     Output('processing-alert', 'is_open'),
+     Output('processing-alert', 'children'),
+     Output('alert', 'is_open', allow_duplicate=True),
+     Output('alert', 'children', allow_duplicate=True),
+     Output('alert', 'color', allow_duplicate=True)],
+    [Input('keyword-task', 'data'),
+     Input('job-poll', 'n_intervals')],
+    prevent_initial_call=True
+)
+def poll_keyword_job(task, n_intervals):
+    hidden = {'visibility': 'hidden'}
+    status = keyword_jobs.status(task['task_id']) if task else None
+    if status is None:
+        return 0, '', hidden, True, False, dash.no_update, False, '', True, "Keyword analysis job not found", "danger"
+    if status['state'] == 'error':
+        return 0, '', hidden, True, False, dash.no_update, False, '', True, f"An error occurred: {status['error']}", "danger"
+    if status['state'] == 'done':
+        result = status['result']
+        return 100, '', hidden, True, False, {'job_id': result['job_id']}, True, result['message'], dash.no_update, dash.no_update, dash.no_update
+
+    done, total = status.get('done', 0), task['total']
+    return (100 * done // max(total, 1), f"{done} / {total} keywords", {'visibility': 'visible'}, False, True,
+            dash.no_update, False, '', dash.no_update, dash.no_update, dash.no_update)
 
 # Callback for updating the bar chart
 @app.callback(
     Output('bar-chart', 'figure'),
     [Input('processed-data', 'data')]
 )
-def update_bar_chart(processed_data):
+def update_bar_chart(job):
     logger.info("Updating bar chart")
-    if processed_data is None:
+    result = get_job_result(job)
+    if result is None:
         logger.info("No processed data available")
         return {
             'data': [],
@@ -458,10 +694,8 @@ def update_bar_chart(processed_data):
             }
         }
 
-    df = pd.DataFrame(processed_data)
-    logger.info(f"Data shape: {df.shape}")
-    intent_counts = df['Intent'].value_counts().reset_index()
-    intent_counts.columns = ['Intent', 'Count']
+    logger.info(f"Data shape: ({len(result)}, {len(RESULT_COLUMNS)})")
+    intent_counts = pd.DataFrame(list(result.intent_counts.items()), columns=['Intent', 'Count'])
 
     fig = px.bar(intent_counts, x='Intent', y='Count', color='Intent', 
                  title='Keyword Intent Distribution', 
@@ -483,61 +717,70 @@ def update_bar_chart(processed_data):
 
     return fig
 
-# Callback for updating the dropdown and download button
+# Callback for updating the dropdown and the download links
 @app.callback(
     [Output('table-intent-dropdown', 'options'),
-     Output('download-button', 'disabled')],
+     Output('download-button', 'disabled'),
+     Output('download-button', 'href'),
+     Output('download-csv-gz-link', 'href'),
+     Output('download-parquet-link', 'href'),
+     Output('download-links', 'style')],
     [Input('processed-data', 'data')]
 )
-def update_dropdown_and_button(processed_data):
-    if processed_data is None:
-        return [], True
+def update_dropdown_and_button(job):
+    result = get_job_result(job)
+    if result is None:
+        return [], True, None, None, None, {'display': 'none'}
 
-    df = pd.DataFrame(processed_data)
-    intents = df['Intent'].unique()
-    options = [{'label': intent, 'value': intent} for intent in intents]
-    return options, False
+    options = [{'label': intent, 'value': intent} for intent in result.intents]
+    # Exports are streamed by the /download route rather than sent through the callback
+    hrefs = [app.get_relative_path(f"/download/{job['job_id']}.{fmt}") for fmt in EXPORT_FORMATS]
+    return (options, False, *hrefs, {'display': 'block'})
 
-# Callback for updating the keywords table
+# Callback for updating the keywords table: one page of the selected intent's rows
 @app.callback(
-    Output('keywords-table', 'children'),
-    [Input('table-intent-dropdown', 'value')],
+    [Output('keywords-datatable', 'data'),
+     Output('keywords-datatable', 'page_count'),
+     Output('keywords-datatable', 'page_current'),
+     Output('keywords-table', 'style'),
+     Output('table-filter-warning', 'children')],
+    [Input('table-intent-dropdown', 'value'),
+     Input('keywords-datatable', 'page_current'),
+     Input('keywords-datatable', 'page_size'),
+     Input('keywords-datatable', 'sort_by'),
+     Input('keywords-datatable', 'filter_query')],
     [State('processed-data', 'data')]
 )
-def update_keywords_table(selected_intent, processed_data):
-    if processed_data is None or selected_intent is None:
-        return html.Div()
-
-    df = pd.DataFrame(processed_data)
-    filtered_df = df[df['Intent'] == selected_intent]
-
-    table = DataTable(
-        columns=[{"name": i, "id": i} for i in filtered_df.columns],
-        data=filtered_df.to_dict('records'),
-        style_table={'overflowX': 'auto'},
-        style_cell={'textAlign': 'left', 'whiteSpace': 'normal', 'height': 'auto', 'minWidth': '100px', 'width': '100px', 'maxWidth': '100px'},
-        style_header={'backgroundColor': 'rgb(30, 30, 30)', 'color': 'white'},
-        style_data={'backgroundColor': 'rgb(50, 50, 50)', 'color': 'white'},
-        sort_action='native',
-        page_action='native',
-        page_current=0
-    )
-    return table
+def update_keywords_table(selected_intent, page_current, page_size, sort_by, filter_query, job):
+    result = get_job_result(job) if selected_intent is not None else None
+    if result is None:
+        return [], 0, 0, {'width': '100%', 'display': 'none'}, None
 
-# Callback for downloading CSV
-@app.callback(
-    Output('download', 'data'),
-    [Input('download-button', 'n_clicks')],
-    [State('processed-data', 'data')]
-)
-def download_csv(n_clicks, processed_data):
-    if n_clicks is None or processed_data is None:
-        return None
+    # A new intent, sort or filter starts again from the first page
+    triggered_id = callback_context.triggered[0]['prop_id'] if callback_context.triggered else ''
+    if not triggered_id.endswith('.page_current'):
+        page_current = 0
 
-    df = pd.DataFrame(processed_data)
-    csv_string = df.to_csv(index=False, encoding='utf-8')
-    return dict(content=csv_string, filename="KeyIntentNER-T_keyword_analysis.csv")
+    # A filter that can't be applied shows all rows with a warning instead of a silently partial filter
+    try:
+        filters, warning = parse_filter_query(filter_query), None
+    except ValueError as e:
+        filters, warning = [], f"{e}. Showing all rows without filtering."
+    rows = result.query(intent=selected_intent, filters=filters, sort_by=sort_by)
+    page_size = page_size or TABLE_PAGE_SIZE
+    page_count = max(1, -(-len(rows) // page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    return result.records(rows[page_current * page_size:(page_current + 1) * page_size]), page_count, page_current, {'width': '100%'}, warning
 
 # Modified the server run command for HuggingFace Spaces
 if __name__ == "__main__":
-    app.run_server(debug=False, host="0.0.0.0", port=7860)
+    parser = argparse.ArgumentParser(description="KeyIntentNER-T dashboard")
+    parser.add_argument('--warmup', action='store_true', help="load models and build the category index before reporting ready on /readyz")
+    args = parser.parse_args()
+
+    if args.warmup and keyword_pipeline.nlp is None:
+        start_warmup()
+    else:
+        # Build or load the category embeddings cache before serving requests
+        preload_category_embeddings()
+    app.run(debug=False, host="0.0.0.0", port=7860)
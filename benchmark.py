@@ -0,0 +1,310 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import keyword_pipeline
+
+# Fixed keyword corpus so benchmark runs are comparable across machines and commits
+BENCHMARK_KEYWORDS = [
+    "Standing desks vs. regular desks",
+    "car repair service my area",
+    "Buy groceries online with delivery",
+    "average cost of car insurance",
+    "top rated laptops 2024",
+    "Book a flight to Hawaii",
+    "Where are some good places to hike near me?",
+    "how to train a puppy to sit",
+    "best running shoes for flat feet",
+    "cheap hotels in new york city",
+    "what is the difference between a roth and traditional ira",
+    "netflix login",
+    "italian restaurants near me open now",
+    "iphone 15 pro max price",
+    "symptoms of vitamin d deficiency",
+    "how to fix a leaking kitchen faucet",
+    "wedding photographer reviews",
+    "learn spanish online free",
+    "home depot store hours",
+    "mortgage calculator with taxes and insurance",
+    "organic dog food discount code",
+    "history of the roman empire",
+    "electric car charging stations nearby",
+    "yoga classes for beginners",
+    "compare cloud storage providers",
+    "kids birthday party ideas",
+    "buy concert tickets taylor swift",
+    "how does solar power work",
+    "plumber emergency same day",
+    "anime streaming sites",
+    "gluten free bread recipe",
+    "used toyota camry for sale",
+    "tax preparation services cost",
+    "marathon training plan 16 weeks",
+    "best budget gaming headset",
+    "facebook marketplace",
+    "dentist accepting new patients near me",
+    "vegan protein powder reviews",
+    "how to write a cover letter",
+    "weather forecast this weekend",
+]
+
+def load_keywords(path):
+    if not path:
+        return BENCHMARK_KEYWORDS
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def print_table(rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(format_value(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(format_value(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def format_value(value):
+    return f"{value:.4f}" if isinstance(value, float) else str(value)
+
+# Recall@k of each topic index backend against exact search, plus build and query latency.
+# Backends whose optional dependency is missing are skipped.
+def benchmark_topic_index(keywords, backends, k=10, repeats=5):
+    queries = keyword_pipeline.get_sentence_model().encode(keywords, show_progress_bar=False)
+    _, exact_indices = keyword_pipeline.ExactTopicIndex('float32').search(queries, k)
+
+    rows = []
+    for backend in backends:
+        start = time.perf_counter()
+        try:
+            index = keyword_pipeline.get_topic_index(backend)
+        except ImportError as e:
+            # Optional backends (hnsw needs hnswlib) are reported and skipped
+            print(f"Skipping {backend}: {e}")
+            continue
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _, indices = index.search(queries, k)
+        ms_per_query = 1000 * (time.perf_counter() - start) / (repeats * len(keywords))
+
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(exact_indices.tolist(), indices.tolist())])
+        rows.append({'backend': backend, f'recall@{k}': float(recall), 'ms/query': ms_per_query, 'load/build s': build_seconds})
+    return rows
+
+# Top-1 topic agreement of each quantized store with the float32 matrix, plus size and scoring latency
+def benchmark_quantization(keywords, dtypes, repeats=5):
+    queries = keyword_pipeline.get_sentence_model().encode(keywords, show_progress_bar=False)
+    reference = keyword_pipeline.score_category_similarities(queries, dtype='float32').argmax(axis=1)
+
+    rows = []
+    for dtype in dtypes:
+        store = keyword_pipeline.get_category_embeddings() if dtype == 'float32' else keyword_pipeline.get_quantized_category_embeddings(dtype)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            similarities = keyword_pipeline.score_category_similarities(queries, dtype=dtype)
+        ms_per_query = 1000 * (time.perf_counter() - start) / (repeats * len(keywords))
+        agreement = float(np.mean(similarities.argmax(axis=1) == reference))
+        rows.append({'dtype': dtype, 'top-1 agreement': agreement, 'MB': store.nbytes / 2**20, 'ms/query': ms_per_query})
+    return rows
+
+# Model-free check of QuantizedEmbeddingStore against exact float32 top-k on seeded
+# synthetic embeddings: clustered unit rows, so there are many near-ties, and noisy
+# queries near them. Each dtype's score error must stay within its quantization bound.
+def check_quantization(dtypes, rows=6000, dim=384, queries=500, k=5, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((rows // 100, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, len(centers), rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    query_embeddings = embeddings[rng.choice(rows, queries, replace=False)] + 0.5 * rng.standard_normal((queries, dim)).astype(np.float32)
+    query_embeddings /= np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+
+    exact = query_embeddings @ embeddings.T
+    _, exact_indices = keyword_pipeline.top_k_similarities(exact, k)
+    results = []
+    for dtype in dtypes:
+        store = keyword_pipeline.QuantizedEmbeddingStore.quantize(embeddings, dtype)
+        similarities = store.dot(query_embeddings)
+        _, indices = keyword_pipeline.top_k_similarities(similarities, k)
+        # Worst case per score: half a step per int8 code, or float16's relative rounding, plus float32 slack
+        if dtype == 'int8':
+            bound = (store.scales[None, :] / 2) * np.abs(query_embeddings).sum(axis=1, keepdims=True)
+        else:
+            bound = 2.0 ** -11 * (np.abs(query_embeddings) @ np.abs(embeddings).T)
+        results.append({
+            'dtype': dtype,
+            'max error': float(np.abs(similarities - exact).max()),
+            'within bound': bool(np.all(np.abs(similarities - exact) <= bound + 1e-5)),
+            'top-1 agreement': float(np.mean(indices[:, 0] == exact_indices[:, 0])),
+            f'recall@{k}': float(np.mean([len(set(a) & set(b)) / k for a, b in zip(exact_indices.tolist(), indices.tolist())])),
+        })
+    return results
+
+# Side-by-side comparison of sentence models on the same keywords: load and category
+# index time, encoding latency, memory, and top-1 topic agreement with the first model
+def compare_sentence_models(keywords, model_names, repeats=3):
+    rows, topics = [], {}
+    reference = None
+    for model_name in model_names:
+        start = time.perf_counter()
+        model = keyword_pipeline.get_sentence_model(model_name)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        category_embeddings = keyword_pipeline.get_category_embeddings(model_name)
+        index_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            queries = model.encode(keywords, show_progress_bar=False)
+        encode_ms = 1000 * (time.perf_counter() - start) / (repeats * len(keywords))
+
+        similarities = keyword_pipeline.score_category_similarities(queries, dtype='float32', model_name=model_name)
+        best = similarities.argmax(axis=1)
+        reference = best if reference is None else reference
+        topics[model_name] = keyword_pipeline.select_top_topics(similarities)
+
+        model_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+        rows.append({
+            'model': model_name,
+            'dim': category_embeddings.shape[1],
+            'load s': load_seconds,
+            'category index s': index_seconds,
+            'encode ms/keyword': encode_ms,
+            'model MB': model_mb,
+            'category MB': category_embeddings.nbytes / 2**20,
+            f'top-1 agreement vs {model_names[0]}': float(np.mean(best == reference)),
+        })
+    return rows, topics
+
+# Parity of each sentence model backend with PyTorch embeddings, and encoding throughput
+def benchmark_sentence_backends(keywords, backends, model_name=None, batch_size=32, repeats=5):
+    reference = keyword_pipeline.get_sentence_model(model_name, 'torch').encode(keywords, batch_size=batch_size, show_progress_bar=False)
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+
+    rows = []
+    for backend in backends:
+        model = keyword_pipeline.get_sentence_model(model_name, backend)
+        model.encode(keywords[:batch_size], batch_size=batch_size, show_progress_bar=False)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            embeddings = model.encode(keywords, batch_size=batch_size, show_progress_bar=False)
+        elapsed = time.perf_counter() - start
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        cosine = np.sum(reference * embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True), axis=1)
+        rows.append({'backend': backend, 'min cosine vs torch': float(cosine.min()), 'mean cosine vs torch': float(cosine.mean()),
+                     'keywords/s': repeats * len(keywords) / elapsed})
+    return rows
+
+# Accuracy drift and speedup of alternative GLiNER backends against the stock pipeline
+def benchmark_ner_backends(keywords, backends, batch_size=8, repeats=3):
+    def run(config):
+        pipeline = keyword_pipeline.build_nlp(config)
+        keyword_pipeline.extract_entities_batch(keywords[:batch_size], batch_size=batch_size, pipeline=pipeline)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            entities = keyword_pipeline.extract_entities_batch(keywords, batch_size=batch_size, pipeline=pipeline)
+        seconds = (time.perf_counter() - start) / repeats
+        return [set(entity_list or ()) for entity_list in entities], seconds
+
+    reference, reference_seconds = run({**keyword_pipeline.custom_spacy_config, 'ner_backend': 'torch'})
+    rows = []
+    for backend in backends:
+        entities, seconds = run({**keyword_pipeline.custom_spacy_config, 'ner_backend': backend})
+        matched = sum(len(a & b) for a, b in zip(reference, entities))
+        predicted, expected = sum(map(len, entities)), sum(map(len, reference))
+        precision = matched / predicted if predicted else 1.0
+        recall = matched / expected if expected else 1.0
+        rows.append({
+            'backend': backend,
+            'identical keywords': float(np.mean([a == b for a, b in zip(reference, entities)])),
+            'entity precision': precision,
+            'entity recall': recall,
+            'entity F1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            'keywords/s': len(keywords) / seconds,
+            'speedup': reference_seconds / seconds,
+        })
+    return rows
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="KeyIntentNER-T benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    topic_index = subparsers.add_parser('topic-index', help="recall vs latency of the topic index backends")
+    topic_index.add_argument('--keywords', help="keyword file, one per line (default: built-in corpus)")
+    topic_index.add_argument('--backends', nargs='+', default=['exact', 'ivf', 'hnsw'], choices=sorted(keyword_pipeline.TOPIC_INDEX_BACKENDS))
+    topic_index.add_argument('-k', type=int, default=10, help="neighbours compared for recall (default: 10)")
+    topic_index.add_argument('--repeats', type=int, default=5)
+
+    quantization = subparsers.add_parser('quantization', help="top-1 topic agreement of quantized category embeddings with float32")
+    quantization.add_argument('--keywords', help="keyword file, one per line (default: built-in corpus)")
+    quantization.add_argument('--dtypes', nargs='+', default=['float32', 'float16', 'int8'], choices=['float32', 'float16', 'int8'])
+    quantization.add_argument('--threshold', type=float, default=0.95, help="minimum top-1 agreement; exit 1 if any dtype falls below (default: 0.95)")
+    quantization.add_argument('--repeats', type=int, default=5)
+
+    check = subparsers.add_parser('quantization-check', help="model-free top-k check of the quantized stores against float32")
+    check.add_argument('--dtypes', nargs='+', default=['float16', 'int8'], choices=['float16', 'int8'])
+    check.add_argument('-k', type=int, default=5, help="neighbours compared for recall (default: 5)")
+    check.add_argument('--threshold', type=float, default=0.95, help="minimum recall@k; exit 1 below it or if any error exceeds its bound (default: 0.95)")
+    check.add_argument('--seed', type=int, default=0)
+
+    models = subparsers.add_parser('compare-models', help="latency, memory and topic agreement of several sentence models")
+    models.add_argument('models', nargs='+', help="sentence-transformers model names; the first is the agreement reference")
+    models.add_argument('--keywords', help="keyword file, one per line (default: built-in corpus)")
+    models.add_argument('--show-topics', action='store_true', help="also print each model's topic per keyword")
+    models.add_argument('--repeats', type=int, default=3)
+
+    backends = subparsers.add_parser('sentence-backends', help="parity and throughput of the sentence model inference backends")
+    backends.add_argument('--keywords', help="keyword file, one per line (default: built-in corpus)")
+    backends.add_argument('--model', help="sentence model (default: the configured model)")
+    backends.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'torch-int8'], choices=['torch', 'onnx', 'torch-int8'])
+    backends.add_argument('--min-cosine', type=float, default=0.99, help="minimum cosine similarity to the PyTorch embeddings; exit 1 below it (default: 0.99)")
+    backends.add_argument('--batch-size', type=int, default=32)
+    backends.add_argument('--repeats', type=int, default=5)
+
+    ner = subparsers.add_parser('ner-backends', help="accuracy drift and speedup of GLiNER backends vs the stock pipeline")
+    ner.add_argument('--keywords', help="keyword file, one per line (default: built-in corpus)")
+    ner.add_argument('--backends', nargs='+', default=['torch', 'quantized'], choices=['torch', 'quantized', 'onnx'])
+    ner.add_argument('--batch-size', type=int, default=8)
+    ner.add_argument('--repeats', type=int, default=3)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    keywords = load_keywords(getattr(args, 'keywords', None))
+    if args.command == 'topic-index':
+        print_table(benchmark_topic_index(keywords, args.backends, k=args.k, repeats=args.repeats))
+    elif args.command == 'quantization':
+        rows = benchmark_quantization(keywords, args.dtypes, repeats=args.repeats)
+        print_table(rows)
+        failed = [row['dtype'] for row in rows if row['top-1 agreement'] < args.threshold]
+        if failed:
+            print(f"Top-1 agreement below {args.threshold} for: {', '.join(failed)}")
+            sys.exit(1)
+    elif args.command == 'quantization-check':
+        rows = check_quantization(args.dtypes, k=args.k, seed=args.seed)
+        print_table(rows)
+        failed = [row['dtype'] for row in rows if not row['within bound'] or row[f'recall@{args.k}'] < args.threshold]
+        if failed:
+            print(f"Quantized top-{args.k} check failed for: {', '.join(failed)}")
+            sys.exit(1)
+    elif args.command == 'sentence-backends':
+        rows = benchmark_sentence_backends(keywords, args.backends, model_name=args.model, batch_size=args.batch_size, repeats=args.repeats)
+        print_table(rows)
+        failed = [row['backend'] for row in rows if row['min cosine vs torch'] < args.min_cosine]
+        if failed:
+            print(f"Embedding parity below {args.min_cosine} for: {', '.join(failed)}")
+            sys.exit(1)
+    elif args.command == 'ner-backends':
+        print_table(benchmark_ner_backends(keywords, args.backends, batch_size=args.batch_size, repeats=args.repeats))
+    elif args.command == 'compare-models':
+        rows, topics = compare_sentence_models(keywords, args.models, repeats=args.repeats)
+        print_table(rows)
+        if args.show_topics:
+            print()
+            print_table([{'keyword': keyword, **{model: keyword_pipeline.format_topics(topics[model][i] or []) for model in args.models}} for i, keyword in enumerate(keywords)])
+
+if __name__ == "__main__":
+    main()
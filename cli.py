@@ -0,0 +1,143 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from keyword_pipeline import (
+    STREAM_CHUNK_SIZE,
+    logger,
+    parallel_stream_process_keywords,
+    stream_process_keywords,
+)
+
+# Columns written for every keyword, in output order
+OUTPUT_COLUMNS = ['Keywords', 'Intent', 'NER Entities', 'Google Content Topics']
+
+INPUT_FORMATS = ('txt', 'csv', 'parquet')
+OUTPUT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+# Infer a file format from its extension, falling back to a default
+def detect_format(path, default, allowed):
+    if path and path != '-':
+        ext = os.path.splitext(path)[1].lower().lstrip('.')
+        if ext in allowed:
+            return ext
+    return default
+
+# Stream keywords from a .txt (one per line), .csv or .parquet file, or stdin
+def iter_input_keywords(path, fmt, column=None):
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        names = parquet_file.schema_arrow.names
+        column = column or names[0]
+        if column not in names:
+            raise SystemExit(f"Column {column!r} not found in {path}; available columns: {', '.join(names)}")
+        for record_batch in parquet_file.iter_batches(columns=[column]):
+            yield from record_batch.column(0).to_pylist()
+        return
+
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8', errors='replace', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            if column is not None:
+                if column not in header:
+                    raise SystemExit(f"Column {column!r} not found in CSV header; available columns: {', '.join(header)}")
+                index = header.index(column)
+            else:
+                # Without --column, use the first column and keep the first row unless it looks like a header
+                index = 0
+                if header and header[0].strip().lower() not in ('keyword', 'keywords'):
+                    yield header[0]
+            for row in reader:
+                if len(row) > index:
+                    yield row[index]
+        else:
+            for line in f:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+# Output writers consume processed_data chunks and write them as they arrive
+def write_csv(chunks, f):
+    writer = csv.writer(f)
+    writer.writerow(OUTPUT_COLUMNS)
+    for chunk in chunks:
+        writer.writerows(zip(*(chunk[column] for column in OUTPUT_COLUMNS)))
+        f.flush()
+
+def write_jsonl(chunks, f):
+    for chunk in chunks:
+        for row in zip(*(chunk[column] for column in OUTPUT_COLUMNS)):
+            f.write(json.dumps(dict(zip(OUTPUT_COLUMNS, row)), ensure_ascii=False) + '\n')
+        f.flush()
+
+def write_parquet(chunks, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(column, pa.string()) for column in OUTPUT_COLUMNS])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pydict({column: chunk[column] for column in OUTPUT_COLUMNS}, schema=schema))
+
+# Log throughput after every chunk
+def log_progress(chunks):
+    start = time.time()
+    done = 0
+    for chunk in chunks:
+        done += len(chunk['Keywords'])
+        elapsed = time.time() - start
+        logger.info(f"Processed {done} keywords in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} keywords/s)")
+        yield chunk
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run KeyIntentNER-T keyword analysis (intent, NER, topics) without the web server")
+    parser.add_argument('input', nargs='?', default='-', help="keyword file (.txt, .csv or .parquet), or - for stdin (default)")
+    parser.add_argument('-o', '--output', default='-', help="output file (.csv, .jsonl or .parquet), or - for stdout (default)")
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, help="input format (default: from the file extension, else txt)")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, help="output format (default: from the file extension, else csv)")
+    parser.add_argument('--column', help="keyword column for CSV/Parquet input (default: first column)")
+    parser.add_argument('--batch-size', type=int, default=8, help="keywords per model batch (default: 8)")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes, each with its own models (default: 1, run in-process)")
+    parser.add_argument('--torch-threads', type=int, help="torch threads per worker process (default: CPU count / workers)")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help=f"keywords per output chunk (default: {STREAM_CHUNK_SIZE})")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    input_format = args.input_format or detect_format(args.input, 'txt', INPUT_FORMATS)
+    output_format = args.output_format or detect_format(args.output, 'csv', OUTPUT_FORMATS)
+    if input_format == 'parquet' and args.input == '-':
+        raise SystemExit("Parquet input cannot be read from stdin")
+    if output_format == 'parquet' and args.output == '-':
+        raise SystemExit("Parquet output cannot be written to stdout")
+
+    stats = {}
+    keywords = iter_input_keywords(args.input, input_format, args.column)
+    if args.workers > 1:
+        chunks = parallel_stream_process_keywords(keywords, workers=args.workers, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                                                  torch_threads=args.torch_threads, stats=stats)
+    else:
+        chunks = stream_process_keywords(keywords, chunk_size=args.chunk_size, batch_size=args.batch_size, stats=stats)
+    chunks = log_progress(chunks)
+
+    if output_format == 'parquet':
+        write_parquet(chunks, args.output)
+    else:
+        f = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8', newline='')
+        try:
+            (write_jsonl if output_format == 'jsonl' else write_csv)(chunks, f)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+    logger.info(f"Request stats: {stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1372 @@
+import spacy
+from spacy.tokens import Span
+from sentence_transformers import SentenceTransformer
+from gliner_spacy.pipeline import GlinerSpacy
+import numpy as np
+import warnings
+import os
+import gc
+import hashlib
+import logging
+import re
+import json
+import sqlite3
+import threading
+import queue
+import time
+import contextvars
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from collections import Counter, OrderedDict, deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Suppress specific warnings
+warnings.filterwarnings("ignore", message="The sentencepiece tokenizer")
+
+# Reference absolute file path 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATEGORIES_FILE = os.path.join(BASE_DIR, 'google_categories.txt')
+CACHE_DIR = os.environ.get('KEYINTENT_CACHE_DIR', os.path.join(BASE_DIR, '.cache'))
+
+# Inference backend for the sentence model: 'torch' (eager PyTorch), 'onnx' (ONNX
+# Runtime, exported once and cached on disk) or 'torch-int8' (dynamic int8 quantization)
+SENTENCE_BACKEND = os.environ.get('KEYINTENT_SENTENCE_BACKEND', 'torch')
+
+# Sentence transformer used for topic modeling. Larger models such as
+# all-roberta-large-v1 give better topics at a higher cost per keyword.
+SENTENCE_MODEL_NAME = os.environ.get('KEYINTENT_SENTENCE_MODEL', 'all-MiniLM-L6-v2')
+
+# Keywords per chunk in streaming mode; bounds memory independently of input size
+STREAM_CHUNK_SIZE = 1000
+
+# Run intent, NER and topic stages concurrently on bounded queues (KEYINTENT_PIPELINED=0 to disable)
+PIPELINED_STAGES = os.environ.get('KEYINTENT_PIPELINED', '1') == '1'
+PIPELINE_QUEUE_SIZE = 4
+
+# Bump when the on-disk format of cached category embeddings changes
+CATEGORY_CACHE_VERSION = 2
+
+# Configuration for GLiNER integration. "ner_backend" selects how GLiNER runs:
+# "torch" (stock), "quantized" (dynamic int8 on CPU) or "onnx" (ONNX export loaded
+# from "onnx_model", a local directory or hub repo containing "onnx_model_file")
+custom_spacy_config = {
+    "gliner_model": "urchade/gliner_small-v2.1",
+    "chunk_size": 128,
+    "labels": ["person", "organization", "location", "event", "work_of_art", "product", "service", "date", "number", "price", "address", "phone_number", "misc"],
+    "threshold": 0.5,
+    "ner_backend": os.environ.get('KEYINTENT_NER_BACKEND', 'torch'),
+    "onnx_model": os.environ.get('KEYINTENT_NER_ONNX_MODEL'),
+    "onnx_model_file": "model.onnx",
+}
+
+# Keys used by this app only; everything else is passed to the gliner_spacy factory
+NER_BACKEND_CONFIG_KEYS = ("ner_backend", "onnx_model")
+
+# Model variables for lazy loading; the lock keeps concurrent jobs, API requests and
+# warmup from loading the same model twice
+model_load_lock = threading.RLock()
+nlp = None
+sentence_model = None
+sentence_models = {}
+google_categories = []
+category_embeddings = {}
+
+# Batched replacement for GlinerSpacy's per-doc __call__, used by nlp.pipe. Mirrors the
+# stock component for style='ent': flat NER, scores on span._.score, spans in doc.ents.
+def gliner_batch_pipe(component, docs, batch_size=8):
+    # inference() takes batch_size on current gliner; batch_predict_entities is the old API and
+    # is only used when inference() is missing
+    if hasattr(component.model, 'inference'):
+        def predict(texts):
+            return component.model.inference(texts, component.labels, flat_ner=True,
+                                             threshold=component.threshold, batch_size=batch_size)
+    else:
+        def predict(texts):
+            return component.model.batch_predict_entities(texts, component.labels, flat_ner=True,
+                                                          threshold=component.threshold)
+    has_score = Span.has_extension('score')
+    for batch in spacy.util.minibatch(docs, size=batch_size):
+        # chunk_size is in characters; longer texts still go through the component's own chunking
+        short_docs = [doc for doc in batch if len(doc.text) <= component.chunk_size]
+        predictions = predict([doc.text for doc in short_docs]) if short_docs else []
+        predicted = dict(zip(map(id, short_docs), predictions))
+        for doc in batch:
+            if id(doc) not in predicted:
+                yield component(doc)
+                continue
+            spans = []
+            for ent in predicted[id(doc)]:
+                span = doc.char_span(ent['start'], ent['end'], label=ent['label'])
+                if span is not None:
+                    if has_score:
+                        span._.score = ent['score']
+                    spans.append(span)
+            doc.ents = spacy.util.filter_spans(spans)
+            yield doc
+
+# Give the GLiNER component a pipe() so nlp.pipe feeds GLiNER padded batches
+def enable_gliner_batching(component):
+    model = getattr(component, 'model', None)
+    if not all(hasattr(component, attr) for attr in ('labels', 'threshold', 'chunk_size')) or model is None \
+            or not (hasattr(model, 'batch_predict_entities') or hasattr(model, 'inference')):
+        logger.info("GLiNER component does not expose batch prediction; nlp.pipe will run per keyword")
+        return
+    # style='span' writes doc.spans['sc'] with overlapping spans; leave it to the stock component
+    if getattr(component, 'style', 'ent') != 'ent':
+        logger.info(f"GLiNER component uses style={component.style!r}; nlp.pipe will run per keyword")
+        return
+    component.pipe = lambda docs, batch_size=8: gliner_batch_pipe(component, docs, batch_size=batch_size)
+
+# gliner_spacy factory config for the selected backend. The ONNX export is loaded by the
+# factory itself, so the torch model is never loaded on that path.
+def gliner_factory_config(config):
+    backend = config.get("ner_backend", "torch")
+    if backend not in ("torch", "quantized", "onnx"):
+        raise ValueError(f"Unsupported NER backend: {backend}")
+    factory_config = {k: v for k, v in config.items() if k not in NER_BACKEND_CONFIG_KEYS}
+    if backend == "onnx":
+        factory_config.update(gliner_model=config.get("onnx_model") or config["gliner_model"], load_onnx_model=True)
+    else:
+        factory_config.pop("onnx_model_file", None)
+    return factory_config
+
+# Quantize the component's torch GLiNER model in place for the "quantized" backend
+def apply_ner_backend(component, config):
+    if config.get("ner_backend", "torch") == "quantized":
+        import torch
+        component.model = torch.quantization.quantize_dynamic(component.model.to('cpu'), {torch.nn.Linear}, dtype=torch.qint8)
+
+# Build a spaCy pipeline with the GLiNER component for the given config
+def build_nlp(config):
+    pipeline = spacy.blank("en")
+    gliner = pipeline.add_pipe("gliner_spacy", config=gliner_factory_config(config))
+    apply_ner_backend(gliner, config)
+    enable_gliner_batching(gliner)
+    return pipeline
+
+# Function to lazy load NLP model
+def get_nlp():
+    global nlp
+    if nlp is None:
+        with model_load_lock:
+            if nlp is None:
+                try:
+                    logger.info(f"Loading spaCy model ({custom_spacy_config['ner_backend']} NER backend)")
+                    nlp = build_nlp(custom_spacy_config)
+                    logger.info("spaCy model loaded successfully")
+                except Exception as e:
+                    logger.exception("Error loading spaCy model")
+                    raise
+    return nlp
+
+# Load a sentence transformer with the given inference backend
+def load_sentence_model(model_name, backend):
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+    if backend == 'torch-int8':
+        import torch
+        model = SentenceTransformer(model_name, device='cpu')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == 'onnx':
+        # Reuse a previous export; otherwise export (or download) the ONNX model and cache it
+        export_dir = os.path.join(CACHE_DIR, 'models', f"{model_name.replace('/', '_')}-onnx")
+        if os.path.exists(os.path.join(export_dir, 'modules.json')):
+            return SentenceTransformer(export_dir, backend='onnx', device='cpu')
+        model = SentenceTransformer(model_name, backend='onnx', device='cpu')
+        try:
+            model.save_pretrained(export_dir)
+            logger.info(f"Saved ONNX sentence model to {export_dir}")
+        except Exception as e:
+            logger.exception("Error saving exported ONNX sentence model")
+        return model
+    raise ValueError(f"Unsupported sentence model backend: {backend}")
+
+# Function to lazy load sentence transformer model
+def get_sentence_model(model_name=None, backend=None):
+    global sentence_model
+    key = (model_name or SENTENCE_MODEL_NAME, backend or SENTENCE_BACKEND)
+    if key not in sentence_models:
+        with model_load_lock:
+            if key not in sentence_models:
+                logger.info(f"Loading sentence model {key[0]} ({key[1]} backend)")
+                sentence_models[key] = load_sentence_model(*key)
+                if key == (SENTENCE_MODEL_NAME, SENTENCE_BACKEND):
+                    sentence_model = sentence_models[key]
+    return sentence_models[key]
+
+# Load Google's content categories
+def load_google_categories():
+    global google_categories
+    if not google_categories:
+        try:
+            with open(CATEGORIES_FILE, 'r') as f:
+                google_categories = [line.strip() for line in f]
+        except Exception as e:
+            google_categories = []
+    return google_categories
+
+# Process-wide L2-normalized category embedding matrix per sentence model, shared by all requests
+def get_category_embeddings(model_name=None):
+    model_name = model_name or SENTENCE_MODEL_NAME
+    if model_name not in category_embeddings:
+        with model_load_lock:
+            if model_name in category_embeddings:
+                return category_embeddings[model_name]
+            embeddings = compute_category_embeddings(model_name)
+            if len(embeddings):
+                category_embeddings[model_name] = embeddings
+            return embeddings
+    return category_embeddings[model_name]
+
+# Function to perform NER using GLiNER with spaCy
+def perform_ner(text):
+    try:
+        doc = get_nlp()(text)
+        return [(ent.text, ent.label_) for ent in doc.ents]
+    except Exception as e:
+        return []
+
+# Function to extract (text, label) entities using GLiNER with spaCy; None if extraction failed
+def extract_entities(text):
+    try:
+        doc = get_nlp()(text)
+        return [(ent.text, ent.label_) for ent in doc.ents]
+    except Exception as e:
+        logger.exception("Error extracting entities")
+        return None
+
+# Model name as used in cache file names; non-default backends get their own files
+def sentence_model_cache_name(model_name=None):
+    model_name = (model_name or SENTENCE_MODEL_NAME).replace('/', '_')
+    return model_name if SENTENCE_BACKEND == 'torch' else f"{model_name}-{SENTENCE_BACKEND}"
+
+# Cache key for category embeddings: taxonomy file contents + sentence model name and backend
+def category_embeddings_cache_key(model_name=None):
+    digest = hashlib.sha256()
+    with open(CATEGORIES_FILE, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    digest.update(f"|{sentence_model_cache_name(model_name)}|v{CATEGORY_CACHE_VERSION}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def category_embeddings_cache_path(model_name=None):
+    key = category_embeddings_cache_key(model_name)
+    return os.path.join(CACHE_DIR, f"category_embeddings_{sentence_model_cache_name(model_name)}_{key}.npy")
+
+# Load cached category embeddings from disk (memory-mapped), or None if not built yet
+def load_cached_category_embeddings(model_name=None):
+    try:
+        path = category_embeddings_cache_path(model_name)
+        if os.path.exists(path):
+            logger.info(f"Loading cached category embeddings from {path}")
+            return np.load(path, mmap_mode='r')
+    except Exception as e:
+        logger.exception("Error loading cached category embeddings")
+    return None
+
+# Encode all categories and persist them, L2-normalized, as a float32 .npy file
+def build_category_embeddings_cache(model_name=None):
+    model_name = model_name or SENTENCE_MODEL_NAME
+    categories = load_google_categories()
+    logger.info(f"Encoding {len(categories)} categories with {model_name}")
+    with time_stage('category_encoding', len(categories)):
+        embeddings = np.asarray(get_sentence_model(model_name).encode(categories, show_progress_bar=False), dtype=np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    path = category_embeddings_cache_path(model_name)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embeddings)
+        # Atomic rename so concurrent workers never read a half-written file
+        os.replace(tmp_path, path)
+        logger.info(f"Saved category embeddings to {path}")
+        remove_stale_category_caches(model_name, keep=path)
+        return np.load(path, mmap_mode='r')
+    except Exception as e:
+        logger.exception("Error saving category embeddings cache")
+        return embeddings
+
+# Remove category embeddings, topic hierarchy and topic index files built from an older
+# taxonomy file for the same model; keep is one of the current cache files
+def remove_stale_category_caches(model_name, keep):
+    # Exact match on <model>_<16-hex key>, so models whose cache name merely starts
+    # with this one (e.g. "foo" and "foo_bar") keep their files
+    kinds = '|'.join(['category_embeddings', 'topic_hierarchy'] + [f'topic_index_{backend}' for backend in TOPIC_INDEX_BACKENDS])
+    pattern = re.compile(rf"(?:{kinds})_{re.escape(sentence_model_cache_name(model_name))}_([0-9a-f]{{16}})\.(?:npy|npz|bin)")
+    current = pattern.fullmatch(os.path.basename(keep))
+    if current is None:
+        return
+    for name in os.listdir(CACHE_DIR):
+        match = pattern.fullmatch(name)
+        if match and match.group(1) != current.group(1):
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except OSError:
+                pass
+
+# Memory-map an already built category embeddings cache without loading the sentence
+# model or encoding anything, so it is safe before fork. None if the cache is not built yet.
+def map_cached_category_embeddings(model_name=None):
+    model_name = model_name or SENTENCE_MODEL_NAME
+    with model_load_lock:
+        if model_name not in category_embeddings:
+            embeddings = load_cached_category_embeddings(model_name)
+            if embeddings is None:
+                return None
+            category_embeddings[model_name] = embeddings
+        return category_embeddings[model_name]
+
+# Batched entity extraction: streams keywords through nlp.pipe. Keywords whose
+# extraction failed get None.
+def extract_entities_batch(texts, batch_size=8, pipeline=None):
+    try:
+        results = []
+        for doc in (pipeline if pipeline is not None else get_nlp()).pipe(texts, batch_size=batch_size):
+            results.append([(ent.text, ent.label_) for ent in doc.ents])
+        return results
+    except Exception as e:
+        logger.exception("Error in batched entity extraction, falling back to per-keyword extraction")
+        # Per-keyword fallback keeps errors isolated to the keyword that caused them
+        return [extract_entities(text) for text in texts]
+
+# Function to precompute category embeddings
+def compute_category_embeddings(model_name=None):
+    try:
+        embeddings = load_cached_category_embeddings(model_name)
+        if embeddings is None:
+            embeddings = build_category_embeddings_cache(model_name)
+        return embeddings
+    except Exception as e:
+        return []
+
+# Topic selection: candidates kept per keyword, and how far ahead of the runner-up
+# the best category must score to be reported on its own
+TOPIC_TOP_K = 3
+TOPIC_SIMILARITY_RATIO = 1.1
+
+# Storage precision of the category matrix used for topic scoring: float32, float16,
+# or int8 with one scale per row
+EMBEDDING_DTYPE = os.environ.get('KEYINTENT_EMBEDDING_DTYPE', 'float32')
+
+# Quantized category embeddings. Scoring dequantizes small row blocks into a reused
+# float32 buffer that stays in cache, so the matmul still runs through BLAS while only
+# the compact codes stay resident (and are streamed from memory at 1/2 or 1/4 the bytes).
+class QuantizedEmbeddingStore:
+    block_rows = 128
+
+    def __init__(self, codes, scales=None):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, embeddings, dtype):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if dtype == 'float16':
+            return cls(embeddings.astype(np.float16))
+        if dtype == 'int8':
+            scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12) / 127
+            codes = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+            return cls(codes, scales.astype(np.float32))
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dot(self, queries):
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        half = self.scales is None
+        if half:
+            # float16 is decoded on its bit patterns, which is much cheaper than numpy's
+            # float16 -> float32 cast: sign-extend to int32, shift exponent and mantissa
+            # into float32 position and clear the sign copies. The result is the exact
+            # value times 2**-112; that factor is folded into the (unit-norm) queries.
+            codes = self.codes.view(np.int16)
+            queries = queries * np.float32(2.0 ** 112)
+            buffer = np.empty((self.block_rows, self.codes.shape[1]), dtype=np.int32)
+        else:
+            codes = self.codes
+            buffer = np.empty((self.block_rows, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), self.block_rows):
+            rows = codes[start:start + self.block_rows]
+            block = buffer[:len(rows)]
+            block[...] = rows
+            if half:
+                block <<= 13
+                block &= np.int32(-0x70000001)
+            np.matmul(queries, block.view(np.float32).T, out=scores[:, start:start + len(rows)])
+        if not half:
+            scores *= self.scales
+        return scores
+
+quantized_category_stores = {}
+
+# Quantized copy of the category matrix, built once per process, model and dtype. It is
+# quantized from the memory-mapped cache file, so the float32 matrix is not kept resident.
+def get_quantized_category_embeddings(dtype=None, model_name=None):
+    key = (model_name or SENTENCE_MODEL_NAME, dtype or EMBEDDING_DTYPE)
+    if key not in quantized_category_stores:
+        embeddings = category_embeddings.get(key[0])
+        if embeddings is None:
+            embeddings = compute_category_embeddings(key[0])
+        quantized_category_stores[key] = QuantizedEmbeddingStore.quantize(embeddings, key[1])
+    return quantized_category_stores[key]
+
+# Cosine similarities of a batch against all categories in one matmul
+def score_category_similarities(batch_embeddings, dtype=None, model_name=None):
+    dtype = dtype or EMBEDDING_DTYPE
+    batch_embeddings = np.asarray(batch_embeddings, dtype=np.float32)
+    batch_embeddings = batch_embeddings / np.maximum(np.linalg.norm(batch_embeddings, axis=1, keepdims=True), 1e-12)
+    if dtype != 'float32':
+        return get_quantized_category_embeddings(dtype, model_name).dot(batch_embeddings)
+    return batch_embeddings @ get_category_embeddings(model_name).T
+
+# Top-k (scores, indices) per row of a similarity matrix, best first
+def top_k_similarities(similarities, k):
+    k = min(k, similarities.shape[1])
+    top_indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(similarities, top_indices, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(top_indices, order, axis=1)
+
+# Apply the best-vs-second rule to the whole batch of ranked neighbours: per keyword,
+# the best category path alone or followed by the runner-up
+def topics_from_neighbours(top_scores, top_indices, ratio=TOPIC_SIMILARITY_RATIO):
+    categories = load_google_categories()
+    best_only = top_scores[:, 0] > top_scores[:, 1] * ratio
+    return [
+        [categories[best]] if alone else [categories[best], categories[second]]
+        for best, second, alone in zip(top_indices[:, 0], top_indices[:, 1], best_only)
+    ]
+
+# Vectorized top-k topic selection over a (keywords x categories) similarity matrix.
+# Topic selectors return None per keyword on failure so the row is never cached.
+def select_top_topics(similarities, k=TOPIC_TOP_K, ratio=TOPIC_SIMILARITY_RATIO):
+    similarities = np.atleast_2d(similarities)
+    try:
+        top_scores, top_indices = top_k_similarities(similarities, max(2, k))
+        return topics_from_neighbours(top_scores, top_indices, ratio)
+    except Exception as e:
+        logger.exception("Error in topic selection")
+        return [None] * len(similarities)
+
+# Function to perform topic modeling using sentence transformers
+def perform_topic_modeling_from_similarities(similarities):
+    topics = select_top_topics(similarities)[0]
+    return format_topics(topics) if topics is not None else STAGE_ERROR_TEXT['Google Content Topics']
+
+# Topic search strategy: 'flat' scores every category, 'hierarchical' descends the
+# taxonomy tree and only scores leaves under the best-matching branches
+TOPIC_SEARCH = os.environ.get('KEYINTENT_TOPIC_SEARCH', 'flat')
+# Branches kept at the first and second level of the hierarchical search
+TOPIC_HIERARCHY_BEAM = (3, 5)
+
+topic_hierarchy = None
+
+def topic_hierarchy_cache_path(model_name=None):
+    return category_embeddings_cache_path(model_name).replace('category_embeddings_', 'topic_hierarchy_')[:-len('.npy')] + '.npz'
+
+# Level-1 and level-2 nodes of the '>'-delimited taxonomy with their embeddings, and
+# the level-1/level-2 node each category belongs to (-1 for top-level categories)
+def build_topic_hierarchy(model_name=None):
+    categories = load_google_categories()
+    category_embeddings = get_category_embeddings(model_name)
+    row_of = {category: i for i, category in enumerate(categories)}
+    segments = [category.split(' > ') for category in categories]
+    level1_names = list(dict.fromkeys(seg[0] for seg in segments))
+    level2_names = list(dict.fromkeys(' > '.join(seg[:2]) for seg in segments if len(seg) >= 2))
+
+    # Reuse category rows for nodes that are categories themselves; encode the rest
+    missing = [name for name in level1_names + level2_names if name not in row_of]
+    encoded = {}
+    if missing:
+        embeddings = np.asarray(get_sentence_model(model_name).encode(missing, show_progress_bar=False), dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        encoded = dict(zip(missing, embeddings))
+    node_embeddings = lambda names: np.stack([category_embeddings[row_of[name]] if name in row_of else encoded[name] for name in names]).astype(np.float32)
+
+    level1_index = {name: i for i, name in enumerate(level1_names)}
+    level2_index = {name: i for i, name in enumerate(level2_names)}
+    hierarchy = {
+        'level1_names': np.array(level1_names),
+        'level1_embeddings': node_embeddings(level1_names),
+        'level2_names': np.array(level2_names),
+        'level2_embeddings': node_embeddings(level2_names),
+        'level2_parent': np.array([level1_index[name.split(' > ')[0]] for name in level2_names]),
+        'category_level1': np.array([level1_index[seg[0]] for seg in segments]),
+        'category_level2': np.array([level2_index[' > '.join(seg[:2])] if len(seg) >= 2 else -1 for seg in segments]),
+    }
+
+    path = topic_hierarchy_cache_path(model_name)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **hierarchy)
+        os.replace(tmp_path, path)
+        remove_stale_category_caches(model_name, keep=path)
+    except Exception as e:
+        logger.exception("Error saving topic hierarchy cache")
+    return hierarchy
+
+# Load (or build) the topic hierarchy once per process, with child lookups precomputed
+def get_topic_hierarchy():
+    global topic_hierarchy
+    if topic_hierarchy is None:
+        with model_load_lock:
+            if topic_hierarchy is not None:
+                return topic_hierarchy
+            path = topic_hierarchy_cache_path()
+            if os.path.exists(path):
+                with np.load(path, allow_pickle=False) as cached:
+                    hierarchy = {name: cached[name] for name in cached.files}
+            else:
+                hierarchy = build_topic_hierarchy()
+            level1_count, level2_count = len(hierarchy['level1_names']), len(hierarchy['level2_names'])
+            category_level1, category_level2 = hierarchy['category_level1'], hierarchy['category_level2']
+            hierarchy['level1_children'] = [np.flatnonzero(hierarchy['level2_parent'] == i) for i in range(level1_count)]
+            hierarchy['level1_leaves'] = [np.flatnonzero((category_level1 == i) & (category_level2 == -1)) for i in range(level1_count)]
+            hierarchy['level2_leaves'] = [np.flatnonzero(category_level2 == i) for i in range(level2_count)]
+            topic_hierarchy = hierarchy
+    return topic_hierarchy
+
+# Indices of the n highest scores, best first
+def top_n_indices(scores, n):
+    n = min(n, len(scores))
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top])]
+
+# Two-stage topic search: score level-1 nodes, then the level-2 children of the best
+# level-1 branches, then only the categories under the best level-2 branches.
+# Returns per keyword the best and second-best category paths with per-level scores.
+def hierarchical_topic_search(batch_embeddings, beam=TOPIC_HIERARCHY_BEAM):
+    hierarchy = get_topic_hierarchy()
+    categories = load_google_categories()
+    category_embeddings = get_category_embeddings()
+    queries = np.asarray(batch_embeddings, dtype=np.float32)
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    level1_scores = queries @ hierarchy['level1_embeddings'].T
+    matches = []
+    for query, query_level1_scores in zip(queries, level1_scores):
+        level1_best = top_n_indices(query_level1_scores, beam[0])
+        level2_candidates = np.concatenate([hierarchy['level1_children'][i] for i in level1_best])
+        level2_scores = hierarchy['level2_embeddings'][level2_candidates] @ query
+        level2_best = level2_candidates[top_n_indices(level2_scores, beam[1])] if len(level2_candidates) else level2_candidates
+        level2_score_of = dict(zip(level2_candidates.tolist(), level2_scores.tolist()))
+
+        leaf_candidates = np.concatenate([hierarchy['level1_leaves'][i] for i in level1_best] +
+                                         [hierarchy['level2_leaves'][i] for i in level2_best])
+        leaf_scores = category_embeddings[leaf_candidates] @ query
+        ranked = leaf_candidates[top_n_indices(leaf_scores, 2)]
+        leaf_score_of = dict(zip(leaf_candidates.tolist(), leaf_scores.tolist()))
+
+        match = []
+        for leaf in ranked.tolist():
+            level2 = int(hierarchy['category_level2'][leaf])
+            match.append({
+                'path': categories[leaf],
+                'scores': {
+                    'level1': float(query_level1_scores[hierarchy['category_level1'][leaf]]),
+                    'level2': level2_score_of[level2] if level2 >= 0 else None,
+                    'leaf': leaf_score_of[leaf],
+                },
+            })
+        matches.append(match)
+    return matches
+
+# Topic strings from hierarchical matches, using the same best-vs-second rule as select_top_topics
+def select_hierarchical_topics(batch_embeddings, ratio=TOPIC_SIMILARITY_RATIO):
+    try:
+        topics = []
+        for match in hierarchical_topic_search(batch_embeddings):
+            best, second = match[0], match[1] if len(match) > 1 else None
+            if second is None or best['scores']['leaf'] > second['scores']['leaf'] * ratio:
+                topics.append([best['path']])
+            else:
+                topics.append([best['path'], second['path']])
+        return topics
+    except Exception as e:
+        logger.exception("Error in hierarchical topic search")
+        return [None] * len(batch_embeddings)
+
+# Topic lookup backend: 'exact' brute force over all categories (the reference),
+# 'ivf' inverted-file index in pure NumPy, or 'hnsw' graph index (needs hnswlib)
+TOPIC_INDEX_BACKEND = os.environ.get('KEYINTENT_TOPIC_INDEX', 'exact')
+# IVF: clusters probed per query; HNSW: search breadth
+TOPIC_INDEX_NPROBE = int(os.environ.get('KEYINTENT_TOPIC_INDEX_NPROBE', '8'))
+TOPIC_INDEX_EF = int(os.environ.get('KEYINTENT_TOPIC_INDEX_EF', '64'))
+
+# Normalize query embeddings for inner-product search
+def normalize_queries(queries):
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    return queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+# Brute-force search over every category; the reference for the approximate indexes
+class ExactTopicIndex:
+    name = 'exact'
+
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+
+    def search(self, queries, k):
+        return top_k_similarities(score_category_similarities(queries, dtype=self.dtype), k)
+
+# Inverted-file index: categories are clustered with spherical k-means and each query
+# only scores the categories in its `nprobe` closest clusters
+class IVFTopicIndex:
+    name = 'ivf'
+
+    def __init__(self, embeddings, centroids, order, offsets, nprobe=TOPIC_INDEX_NPROBE):
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, iterations=20, seed=0, nprobe=TOPIC_INDEX_NPROBE):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        nlist = min(nlist or max(1, int(4 * np.sqrt(len(embeddings)))), len(embeddings))
+        rng = np.random.default_rng(seed)
+        centroids = embeddings[rng.choice(len(embeddings), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(embeddings @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, embeddings)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            # Re-seed empty clusters with random categories
+            sums[empty] = embeddings[rng.choice(len(embeddings), int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        assignment = np.argmax(embeddings @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+        return cls(embeddings, centroids.astype(np.float32), order, offsets, nprobe=nprobe)
+
+    def search(self, queries, k):
+        queries = normalize_queries(queries)
+        probes = top_k_similarities(queries @ self.centroids.T, self.nprobe)[1]
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        top_indices = np.zeros((len(queries), k), dtype=np.int64)
+        for row, (query, clusters) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in clusters])
+            scores, positions = top_k_similarities((self.embeddings[candidates] @ query)[None, :], k)
+            top_scores[row, :scores.shape[1]] = scores[0]
+            top_indices[row, :positions.shape[1]] = candidates[positions[0]]
+        return top_scores, top_indices
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path, embeddings, nprobe=TOPIC_INDEX_NPROBE):
+        with np.load(path, allow_pickle=False) as cached:
+            return cls(embeddings, cached['centroids'], cached['order'], cached['offsets'], nprobe=nprobe)
+
+# HNSW graph index backed by the optional hnswlib package
+class HNSWTopicIndex:
+    name = 'hnsw'
+
+    def __init__(self, index, ef=TOPIC_INDEX_EF):
+        self.index = index
+        self.index.set_ef(ef)
+
+    @classmethod
+    def build(cls, embeddings, M=16, ef_construction=200, ef=TOPIC_INDEX_EF):
+        import hnswlib
+        index = hnswlib.Index(space='ip', dim=embeddings.shape[1])
+        index.init_index(max_elements=len(embeddings), ef_construction=ef_construction, M=M, random_seed=0)
+        index.add_items(np.asarray(embeddings, dtype=np.float32), np.arange(len(embeddings)))
+        return cls(index, ef=ef)
+
+    def search(self, queries, k):
+        self.index.set_ef(max(self.index.ef, k))
+        labels, distances = self.index.knn_query(normalize_queries(queries), k=k)
+        # hnswlib's 'ip' space returns 1 - inner product
+        return (1 - distances).astype(np.float32), labels.astype(np.int64)
+
+    def save(self, path):
+        self.index.save_index(path)
+
+    @classmethod
+    def load(cls, path, embeddings, ef=TOPIC_INDEX_EF):
+        import hnswlib
+        index = hnswlib.Index(space='ip', dim=embeddings.shape[1])
+        index.load_index(path, max_elements=len(embeddings))
+        return cls(index, ef=ef)
+
+TOPIC_INDEX_BACKENDS = {'exact': ExactTopicIndex, 'ivf': IVFTopicIndex, 'hnsw': HNSWTopicIndex}
+topic_indexes = {}
+
+def topic_index_cache_path(backend, model_name=None):
+    extension = 'npz' if backend == 'ivf' else 'bin'
+    return category_embeddings_cache_path(model_name).replace('category_embeddings_', f'topic_index_{backend}_')[:-len('.npy')] + f'.{extension}'
+
+# Build (or load from disk) the topic index for a backend, once per process
+def get_topic_index(backend=None):
+    backend = backend or TOPIC_INDEX_BACKEND
+    if backend not in topic_indexes:
+        with model_load_lock:
+            if backend in topic_indexes:
+                return topic_indexes[backend]
+            index_class = TOPIC_INDEX_BACKENDS[backend]
+            if backend == 'exact':
+                topic_indexes[backend] = index_class()
+                return topic_indexes[backend]
+
+            embeddings = get_category_embeddings()
+
+            path = topic_index_cache_path(backend)
+            if os.path.exists(path):
+                logger.info(f"Loading {backend} topic index from {path}")
+                index = index_class.load(path, embeddings)
+            else:
+                logger.info(f"Building {backend} topic index over {len(embeddings)} categories")
+                index = index_class.build(embeddings)
+                try:
+                    os.makedirs(CACHE_DIR, exist_ok=True)
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    index.save(tmp_path)
+                    os.replace(tmp_path, path)
+                    remove_stale_category_caches(SENTENCE_MODEL_NAME, keep=path)
+                except Exception as e:
+                    logger.exception("Error saving topic index")
+            topic_indexes[backend] = index
+    return topic_indexes[backend]
+
+# Load the category data topic scoring will use: only the quantized store for exact
+# flat search with a quantized dtype, otherwise the float32 matrix
+def preload_category_embeddings():
+    if TOPIC_SEARCH != 'hierarchical' and TOPIC_INDEX_BACKEND == 'exact' and EMBEDDING_DTYPE != 'float32':
+        return get_quantized_category_embeddings()
+    return get_category_embeddings()
+
+# Topic strings via the configured index backend
+def select_indexed_topics(batch_embeddings, k=TOPIC_TOP_K, ratio=TOPIC_SIMILARITY_RATIO):
+    try:
+        top_scores, top_indices = get_topic_index().search(batch_embeddings, max(2, k))
+        return topics_from_neighbours(top_scores, top_indices, ratio)
+    except Exception as e:
+        logger.exception("Error in indexed topic search")
+        return [None] * len(batch_embeddings)
+
+# Intent phrases, in priority order: a keyword gets the first intent with a matching phrase
+INTENT_KEYWORDS = [
+    ("informational", [
+        "advice", "help", "how do i", "how does", "how to", "ideas", "information", "tools", "list", 
+        "resources", "tips", "tutorial", "diy", "ways to", "what does", "what is", "what was", "where are", "where does", 
+        "where can", "where is", "where was", "when is", "when are", "when was", "where to", "who is", "who said", "who wrote", 
+        "who are", "why are", "who was", "why is", "examples", "explained", "meaning of", "definition", "benefits of", "uses of", 
+        "overview", "summary", "report", "study",  "analysis", "research", "insight", "data", "facts", "details", "background", 
+        "context", "news", "history", "documentation", "article", "paper", "blog", "forum", "discussion", "commentary", 
+        "opinion", "perspective", "viewpoint", "guide", "difference between", "types of"
+    ]),
+    ("navigational", [
+        "facebook", "meta", "twitter", "site", "login", "account", "official website", "homepage", "portal", 
+        "signin", "register", "signup", "dashboard", "profile", "settings", "control panel", "main page", 
+        "user area", "admin", "control", "access", "entry", "webpage", "navigate", "home", "site map", 
+        "directory", "find", "search", "lookup", "index", "online", "internet", "web", "browser", "navigate to", 
+        "goto", "landing page", "url", "hyperlink", "link", "web address", "navigate", 
+        "web navigation", "website address", "app", "download", "status", "join"
+    ]),
+    ("local", [
+        "closest", "close", "near me", "my area", "residential", "my zip", "my city", "nearby", "in town", 
+        "around here", "local", "near", "vicinity", "local area", "nearest", "surrounding", "within miles", 
+        "in my neighborhood", "district", "zone", "region", "near my location", "local services", "community", 
+        "local shop", "in my vicinity", "local store", "suburb", "urban area", "within walking distance", 
+        "around my place", "within my reach", "close by", "local office", "local branch", "near me now", 
+        "in my locale", "within the city", "local market", "in my town", "local spot", "local point", 
+        "local guide", "near my house", "local venue", "close to me", "within blocks", "local attractions", 
+        "local events", "address"
+    ]),
+    ("commercial investigation", [
+        "best", "affordable", "budget", "cheap", "expensive", "review", "top", "service", "cost", "average cost", 
+        "calculator", "provider", "company", "vs", "companies", "professional", "specialist", "compare", 
+        "comparison", "rating", "testimonials", "recommendation", "advisor", "consultant", "expert", "ranking", 
+        "leader", "top-rated", "best-selling", "trending", "featured", "highlighted", "recommended", "popular", 
+        "favorite", "preferred", "choice", "most reviewed", "highest rated", "highly recommended", "award-winning", 
+        "five-star", "customer favorite", "top pick", "critically acclaimed", "editor's choice", "people's choice", 
+        "top performer", "best value", "best overall", "best quality", "best price", "most trusted", "leading brand", 
+        "popular choice", "most popular", "fees", "pros and cons"
+    ]),
+    ("transactional", [
+        "price", "quotes", "pricing", "purchase", "rates", "how much", "same day", "same-day", "buy", "order", 
+        "discount", "deal", "offers", "sale", "checkout", "book", "reservation", "reserve", "bargain", "coupon", 
+        "promo", "rebate", "clearance", "markdown", "buy one get one", "bogo", "special", "exclusive", "bundle", 
+        "package", "subscription", "membership", "payment", "installment", "financing", "contract", "billing", 
+        "invoice", "ticket", "admission", "entry", "enrollment", "register", "sign up", "pre-order", "e-commerce", 
+        "shopping cart"
+    ]),
+]
+
+# Compile all intent phrases into one Aho-Corasick automaton. Each state stores the
+# best (lowest) intent priority of any phrase ending there, including via fail links.
+def build_intent_automaton(intent_keywords):
+    no_match = len(intent_keywords)
+    goto, fail, output = [{}], [0], [no_match]
+    for priority, (intent, phrases) in enumerate(intent_keywords):
+        for phrase in phrases:
+            state = 0
+            for ch in phrase:
+                if ch not in goto[state]:
+                    goto[state][ch] = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    output.append(no_match)
+                state = goto[state][ch]
+            output[state] = min(output[state], priority)
+
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for ch, nxt in goto[state].items():
+            f = fail[state]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f].get(ch, 0)
+            output[nxt] = min(output[nxt], output[fail[nxt]])
+            queue.append(nxt)
+    return goto, fail, output
+
+intent_automaton = build_intent_automaton(INTENT_KEYWORDS)
+
+# Single pass over the text; returns the priority of the best matching intent
+def match_intent_priority(text):
+    goto, fail, output = intent_automaton
+    state, best = 0, len(INTENT_KEYWORDS)
+    for ch in text:
+        while state and ch not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(ch, 0)
+        if output[state] < best:
+            best = output[state]
+            if best == 0:
+                break
+    return best
+
+# Function to sort keywords by intent feature
+def sort_by_keyword_feature(f):
+    if type(f) != str:
+        return "other"
+    priority = match_intent_priority(f.lower())
+    if priority < len(INTENT_KEYWORDS):
+        return INTENT_KEYWORDS[priority][0]
+    return "other"
+
+# Keyword result cache: in-process LRU with TTL, plus an optional SQLite tier that is
+# shared across processes and restarts
+RESULT_CACHE_SIZE = int(os.environ.get('KEYINTENT_RESULT_CACHE_SIZE', '100000'))
+RESULT_CACHE_TTL = int(os.environ.get('KEYINTENT_RESULT_CACHE_TTL', str(7 * 24 * 3600)))
+RESULT_CACHE_DB = os.environ.get('KEYINTENT_RESULT_CACHE_DB', os.path.join(CACHE_DIR, 'keyword_results.sqlite'))
+RESULT_CACHE_DB_SIZE = int(os.environ.get('KEYINTENT_RESULT_CACHE_DB_SIZE', '1000000'))
+# Rows written between purges of expired and excess SQLite rows
+RESULT_CACHE_PRUNE_INTERVAL = 1000
+
+class KeywordResultCache:
+    def __init__(self, max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, db_path=RESULT_CACHE_DB, db_max_size=RESULT_CACHE_DB_SIZE):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+        self.db_max_size = db_max_size
+        # Start at the interval so each process prunes on its first write
+        self._writes_since_prune = RESULT_CACHE_PRUNE_INTERVAL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if self.db_path:
+            self._create_db()
+
+    # Schema and WAL mode are stored in the database file, so they are set up once here
+    # rather than on every per-thread connection
+    def _create_db(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                with conn:
+                    conn.execute("CREATE TABLE IF NOT EXISTS keyword_results (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS keyword_results_expires_at ON keyword_results (expires_at)")
+            finally:
+                conn.close()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Keyword result cache setup failed: {e}")
+
+    # One SQLite connection per thread and process
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, keys):
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+                elif key not in found:
+                    missing.append(key)
+
+        if missing and self.db_path:
+            try:
+                db_found = {}
+                for i in range(0, len(missing), 500):
+                    chunk = list(dict.fromkeys(missing[i:i+500]))
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = self._db().execute(
+                        f"SELECT key, value, expires_at FROM keyword_results WHERE key IN ({placeholders}) AND expires_at > ?",
+                        (*chunk, now)).fetchall()
+                    db_found.update({key: tuple(json.loads(value)) for key, value, _ in rows})
+                found.update(db_found)
+                self._put_memory(db_found, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Keyword result cache lookup failed: {e}")
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        self._put_memory(items, now)
+        if items and self.db_path:
+            try:
+                conn = self._db()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO keyword_results VALUES (?, ?, ?)",
+                                     [(key, json.dumps(value), now + self.ttl) for key, value in items.items()])
+                with self._lock:
+                    self._writes_since_prune += len(items)
+                    prune = self._writes_since_prune >= RESULT_CACHE_PRUNE_INTERVAL
+                    if prune:
+                        self._writes_since_prune = 0
+                if prune:
+                    self._prune_db(conn, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Keyword result cache write failed: {e}")
+
+    # Delete expired rows, then the oldest writes beyond db_max_size
+    def _prune_db(self, conn, now):
+        with conn:
+            conn.execute("DELETE FROM keyword_results WHERE expires_at <= ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM keyword_results").fetchone()[0] - self.db_max_size
+            if excess > 0:
+                conn.execute("DELETE FROM keyword_results WHERE key IN "
+                             "(SELECT key FROM keyword_results ORDER BY expires_at LIMIT ?)", (excess,))
+
+    def _put_memory(self, items, now):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path and os.path.exists(self.db_path):
+            with self._db() as conn:
+                conn.execute("DELETE FROM keyword_results")
+
+keyword_result_cache = KeywordResultCache()
+pipeline_fingerprint_value = None
+
+# Fingerprint of everything that affects a keyword's result; changing any of it
+# invalidates cached results
+def pipeline_fingerprint():
+    global pipeline_fingerprint_value
+    if pipeline_fingerprint_value is None:
+        config = {
+            # Bump when the cached row format or caching rules change
+            'version': 3,
+            'spacy': custom_spacy_config,
+            'sentence_model': [SENTENCE_MODEL_NAME, SENTENCE_BACKEND],
+            'categories': category_embeddings_cache_key(),
+            'topics': [TOPIC_TOP_K, TOPIC_SIMILARITY_RATIO, TOPIC_SEARCH, TOPIC_HIERARCHY_BEAM,
+                       TOPIC_INDEX_BACKEND, TOPIC_INDEX_NPROBE, TOPIC_INDEX_EF, EMBEDDING_DTYPE],
+            'intents': INTENT_KEYWORDS,
+        }
+        pipeline_fingerprint_value = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return pipeline_fingerprint_value
+
+# Case- and whitespace-insensitive form of a keyword
+def normalize_keyword(keyword):
+    return " ".join(keyword.split()).lower()
+
+def keyword_cache_key(keyword, fingerprint):
+    return f"{fingerprint}:{normalize_keyword(keyword)}"
+
+# Format extracted entities the way they are shown in the table and CSV
+def format_entities(entity_list):
+    if not entity_list:
+        return "No specific entities found"
+    return ", ".join(f"{text} ({label})" for text, label in entity_list)
+
+# Format topic paths the way they are shown in the table and CSV
+def format_topics(topics):
+    return " , ".join(topics)
+
+# Per-stage timing: wall time, item counts and batch sizes for each pipeline stage.
+# batch_process_keywords activates a StageTimings for the request; stages timed
+# outside a request (e.g. category encoding at warmup) are logged on their own.
+active_stage_timings = contextvars.ContextVar('active_stage_timings', default=None)
+
+class StageTimings:
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, items, seconds):
+        timing = {'calls': 1, 'items': items, 'seconds': seconds, 'batch_min': items, 'batch_max': items}
+        with self._lock:
+            merge_stage_timings(self.stages, {stage: timing})
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: dict(timing) for stage, timing in self.stages.items()}
+
+# Add per-stage timings into running totals and refresh the derived rates
+def merge_stage_timings(totals, timings):
+    for stage, timing in timings.items():
+        total = totals.setdefault(stage, {'calls': 0, 'items': 0, 'seconds': 0.0,
+                                          'batch_min': timing['batch_min'], 'batch_max': timing['batch_max']})
+        total['calls'] += timing['calls']
+        total['items'] += timing['items']
+        total['seconds'] += timing['seconds']
+        total['batch_min'] = min(total['batch_min'], timing['batch_min'])
+        total['batch_max'] = max(total['batch_max'], timing['batch_max'])
+        total['batch_mean'] = total['items'] / total['calls']
+        total['items_per_second'] = total['items'] / max(total['seconds'], 1e-9)
+    return totals
+
+# Structured log record: the timings go in `extra` for log handlers and as JSON in the message
+def log_stage_timings(timings, **fields):
+    logger.info(f"Stage timings: {json.dumps({**fields, 'stages': timings})}", extra={'stage_timings': timings, **fields})
+
+@contextmanager
+def time_stage(stage, items):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    timings = active_stage_timings.get()
+    if timings is not None:
+        timings.record(stage, items, seconds)
+    else:
+        log_stage_timings(merge_stage_timings({}, {stage: {'calls': 1, 'items': items, 'seconds': seconds,
+                                                           'batch_min': items, 'batch_max': items}}))
+
+# Shown in place of a result whose stage failed; such rows are never cached
+STAGE_ERROR_TEXT = {'NER Entities': "Error extracting entities", 'Google Content Topics': "Error in topic modeling"}
+
+# Pipeline stages: each maps a batch of keywords to one output column, with None for
+# keywords the stage failed on. Entities are (text, label) pairs and topics are lists
+# of category paths; they are formatted for display only when results are fanned out.
+def intent_stage(batch, batch_size=8):
+    with time_stage('intent', len(batch)):
+        return [sort_by_keyword_feature(kw) for kw in batch]
+
+def ner_stage(batch, batch_size=8):
+    with time_stage('ner', len(batch)):
+        return extract_entities_batch(batch, batch_size=batch_size)
+
+def topic_stage(batch, batch_size=8):
+    with time_stage('keyword_encoding', len(batch)):
+        batch_embeddings = get_sentence_model().encode(batch, batch_size=batch_size, show_progress_bar=False)
+    with time_stage('similarity', len(batch)):
+        if TOPIC_SEARCH == 'hierarchical':
+            return select_hierarchical_topics(batch_embeddings)
+        if TOPIC_INDEX_BACKEND != 'exact':
+            return select_indexed_topics(batch_embeddings)
+        similarities = score_category_similarities(batch_embeddings)
+        return select_top_topics(similarities)
+
+KEYWORD_STAGES = [intent_stage, ner_stage, topic_stage]
+
+# Run intent, NER and topic modeling for one batch; returns (intent, entities, topic) rows
+def process_keyword_batch(batch, batch_size=8):
+    return list(zip(*(stage(batch, batch_size) for stage in KEYWORD_STAGES)))
+
+# Run the stages concurrently, one thread per stage connected by bounded queues, so
+# wall-clock time is set by the slowest stage rather than their sum (torch releases
+# the GIL during inference). Yields one list of rows per batch, in input order.
+def pipelined_process_keyword_batches(batches, batch_size=8, queue_size=PIPELINE_QUEUE_SIZE):
+    done_marker = object()
+    stop = threading.Event()
+    inboxes = [queue.Queue(maxsize=queue_size) for _ in KEYWORD_STAGES]
+    outboxes = [queue.Queue(maxsize=queue_size) for _ in KEYWORD_STAGES]
+
+    # Blocking put that gives up once the consumer has stopped
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def feed():
+        for batch in batches:
+            for inbox in inboxes:
+                put(inbox, batch)
+        for inbox in inboxes:
+            put(inbox, done_marker)
+
+    def run_stage(stage, inbox, outbox):
+        while not stop.is_set():
+            try:
+                batch = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if batch is done_marker:
+                put(outbox, done_marker)
+                return
+            try:
+                put(outbox, stage(batch, batch_size))
+            except Exception as e:
+                put(outbox, e)
+
+    threads = [threading.Thread(target=feed, name='pipeline-feed', daemon=True)]
+    # Stage threads run in a copy of the caller's context so they record into its StageTimings
+    threads += [threading.Thread(target=contextvars.copy_context().run, args=(run_stage, stage, inbox, outbox),
+                                 name=f'pipeline-{stage.__name__}', daemon=True)
+                for stage, inbox, outbox in zip(KEYWORD_STAGES, inboxes, outboxes)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            outputs = [outbox.get() for outbox in outboxes]
+            if outputs[0] is done_marker:
+                break
+            for output in outputs:
+                if isinstance(output, Exception):
+                    raise output
+            yield list(zip(*outputs))
+    finally:
+        stop.set()
+
+# Optimized batch processing of keywords. Pass a dict as `stats` to receive
+# per-request counts (keywords, unique keywords, cache hits, dedup ratio), wall time
+# and per-stage timings. With `structured`, entities and topics are returned as lists
+# (None where a stage failed) instead of display strings. `collect_garbage` runs a
+# gc pass after every batch, for the long-running dashboard jobs.
+def batch_process_keywords(keywords, batch_size=8, progress_callback=None, stats=None, structured=False, collect_garbage=False):
+    processed_data = {'Keywords': [], 'Intent': [], 'NER Entities': [], 'Google Content Topics': []}
+    cache_keys, results = [], {}
+    timings = StageTimings()
+    timings_token = active_stage_timings.set(timings)
+    start = time.perf_counter()
+    
+    try:
+        # Duplicate keywords (ignoring case and whitespace) are processed once, and
+        # only those missing from the result cache go through the models
+        fingerprint = pipeline_fingerprint()
+        cache_keys = [keyword_cache_key(kw, fingerprint) for kw in keywords]
+        multiplicity = Counter(cache_keys)
+        first_index = {}
+        for i, key in enumerate(cache_keys):
+            first_index.setdefault(key, i)
+        results = keyword_result_cache.get_many(list(first_index))
+        misses = [i for key, i in first_index.items() if key not in results]
+
+        request_stats = {
+            'keywords': len(keywords),
+            'unique_keywords': len(first_index),
+            'cached_keywords': len(first_index) - len(misses),
+            'dedup_ratio': 1 - len(first_index) / len(keywords) if keywords else 0.0,
+        }
+        if stats is not None:
+            stats.update(request_stats)
+        logger.info(f"Processing {len(keywords)} keywords ({len(first_index)} unique, {len(first_index) - len(misses)} cached)")
+
+        if misses:
+            get_sentence_model()
+            preload_category_embeddings()
+
+        done = sum(multiplicity[key] for key in results)
+        miss_batches = [misses[i:i+batch_size] for i in range(0, len(misses), batch_size)]
+        keyword_batches = [[keywords[j] for j in batch_indices] for batch_indices in miss_batches]
+        if PIPELINED_STAGES and len(keyword_batches) > 1:
+            batch_rows = pipelined_process_keyword_batches(keyword_batches, batch_size=batch_size)
+        else:
+            batch_rows = (process_keyword_batch(batch, batch_size=batch_size) for batch in keyword_batches)
+
+        for batch_number, (batch_indices, rows) in enumerate(zip(miss_batches, batch_rows), start=1):
+            logger.info(f"Processed batch {batch_number}")
+
+            batch_results = {cache_keys[j]: row for j, row in zip(batch_indices, rows)}
+            results.update(batch_results)
+            # Rows with a failed stage are retried on the next request instead of cached
+            keyword_result_cache.put_many({key: row for key, row in batch_results.items() if None not in row})
+
+            # Report (keywords done, total keywords) after each batch
+            done += sum(multiplicity[key] for key in batch_results)
+            if progress_callback is not None:
+                progress_callback(done, len(keywords))
+            
+            if collect_garbage:
+                gc.collect()
+        logger.info("Keyword processing completed successfully")
+    except Exception as e:
+        logger.exception("An error occurred in batch_process_keywords")
+    finally:
+        active_stage_timings.reset(timings_token)
+
+    stage_timings = timings.as_dict()
+    seconds = time.perf_counter() - start
+    log_stage_timings(stage_timings, keywords=len(keywords), seconds=seconds)
+    if stats is not None:
+        stats.update(seconds=seconds, stages=stage_timings)
+
+    # Fan results back out to the original order and multiplicity. On error, return
+    # the keywords processed up to the first one without a result.
+    for kw, key in zip(keywords, cache_keys):
+        if key not in results:
+            break
+        intent, entities, topics = results[key]
+        if not structured:
+            entities = format_entities(entities) if entities is not None else STAGE_ERROR_TEXT['NER Entities']
+            topics = format_topics(topics) if topics is not None else STAGE_ERROR_TEXT['Google Content Topics']
+        processed_data['Keywords'].append(kw)
+        processed_data['Intent'].append(intent)
+        processed_data['NER Entities'].append(entities)
+        processed_data['Google Content Topics'].append(topics)
+    
+    return processed_data
+
+# Streaming mode for large inputs: takes any iterable of keywords and yields one
+# processed_data dict per chunk, so memory stays bounded regardless of input size
+def stream_process_keywords(keywords, chunk_size=STREAM_CHUNK_SIZE, batch_size=8, progress_callback=None, stats=None, collect_garbage=False):
+    done = 0
+    for chunk in iter_keyword_chunks(keywords, chunk_size):
+        chunk_progress = None
+        if progress_callback is not None:
+            # Progress across chunks is reported as a running keyword count
+            chunk_progress = lambda n, _total, offset=done: progress_callback(offset + n)
+        chunk_stats = {}
+        yield batch_process_keywords(chunk, batch_size=batch_size, progress_callback=chunk_progress, stats=chunk_stats,
+                                     collect_garbage=collect_garbage)
+        done += len(chunk)
+        if stats is not None:
+            merge_request_stats(stats, chunk_stats)
+
+# Split an iterable of keywords into stripped, non-empty chunks
+def iter_keyword_chunks(keywords, chunk_size):
+    keywords = (kw.strip() for kw in keywords if isinstance(kw, str))
+    keywords = (kw for kw in keywords if kw)
+    while True:
+        chunk = list(islice(keywords, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+# Process pool initializer: cap torch intra-op threads so workers don't oversubscribe
+# the CPU, then load the models once per worker
+def init_keyword_worker(torch_threads):
+    import torch
+    torch.set_num_threads(torch_threads)
+    warmup_models()
+
+# Runs in a worker process; returns the chunk's results plus timing for that worker
+def process_keyword_shard(keywords, batch_size=8):
+    start = time.time()
+    shard_stats = {}
+    processed_data = batch_process_keywords(keywords, batch_size=batch_size, stats=shard_stats)
+    shard_stats.update(worker=os.getpid(), seconds=time.time() - start)
+    return processed_data, shard_stats
+
+# Multi-process sharded execution: chunks are processed by a pool of workers, each
+# with its own preloaded models, and yielded back in input order. At most two chunks
+# per worker are in flight, so memory stays bounded for any input size.
+def parallel_stream_process_keywords(keywords, workers=None, chunk_size=STREAM_CHUNK_SIZE, batch_size=8, torch_threads=None, stats=None):
+    workers = workers or os.cpu_count() or 1
+    torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+    worker_stats = {}
+    start = time.time()
+
+    chunks = iter_keyword_chunks(keywords, chunk_size)
+    pending = deque()
+    # spawn rather than fork: forking a process that has already initialized torch can deadlock
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_keyword_worker, initargs=(torch_threads,)) as pool:
+        while True:
+            for chunk in islice(chunks, 2 * workers - len(pending)):
+                pending.append(pool.submit(process_keyword_shard, chunk, batch_size))
+            if not pending:
+                break
+            processed_data, shard_stats = pending.popleft().result()
+            totals = worker_stats.setdefault(shard_stats['worker'], {'keywords': 0, 'seconds': 0.0})
+            totals['keywords'] += len(processed_data['Keywords'])
+            totals['seconds'] += shard_stats['seconds']
+            if stats is not None:
+                merge_request_stats(stats, shard_stats)
+            yield processed_data
+
+    elapsed = time.time() - start
+    for worker, totals in worker_stats.items():
+        totals['keywords_per_second'] = totals['keywords'] / max(totals['seconds'], 1e-9)
+        logger.info(f"Worker {worker}: {totals['keywords']} keywords in {totals['seconds']:.1f}s ({totals['keywords_per_second']:.1f} keywords/s)")
+    total_keywords = sum(totals['keywords'] for totals in worker_stats.values())
+    logger.info(f"Processed {total_keywords} keywords with {workers} workers in {elapsed:.1f}s ({total_keywords / max(elapsed, 1e-9):.1f} keywords/s)")
+    if stats is not None:
+        stats['workers'] = worker_stats
+
+# Add one chunk's stats to the running totals for a streamed request
+def merge_request_stats(stats, chunk_stats):
+    for field in ('keywords', 'unique_keywords', 'cached_keywords', 'seconds'):
+        stats[field] = stats.get(field, 0) + chunk_stats.get(field, 0)
+    stats['dedup_ratio'] = 1 - stats['unique_keywords'] / stats['keywords'] if stats['keywords'] else 0.0
+    merge_stage_timings(stats.setdefault('stages', {}), chunk_stats.get('stages', {}))
+    return stats
+
+# Append one chunk's results to an accumulated processed_data dict
+def merge_processed_data(processed_data, chunk):
+    for column, values in chunk.items():
+        processed_data.setdefault(column, []).extend(values)
+    return processed_data
+
+models_ready = threading.Event()
+warmup_error = None
+warmup_thread = None
+
+# Eager warmup: load both models, build the category index and run a dummy
+# inference so the first real request doesn't pay for any lazy initialization
+def warmup_models():
+    global warmup_error
+    try:
+        start = time.time()
+        logger.info("Warming up models")
+        get_nlp()
+        get_sentence_model()
+        preload_category_embeddings()
+        # Bypasses the result cache so the dummy keyword always reaches the models
+        process_keyword_batch(["how to find the best coffee shop near me"])
+        warmup_error = None
+        models_ready.set()
+        logger.info(f"Models ready after {time.time() - start:.1f}s")
+    except Exception as e:
+        warmup_error = str(e)
+        logger.exception("Model warmup failed")
+
+# Warm up in a background thread while the server already answers liveness probes
+def start_warmup():
+    global warmup_thread
+    if warmup_thread is not None and warmup_thread.is_alive():
+        return
+    models_ready.clear()
+    warmup_thread = threading.Thread(target=warmup_models, name='model-warmup', daemon=True)
+    warmup_thread.start()
+
@@ -0,0 +1,127 @@
+import numpy as np
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from keyword_pipeline import CACHE_DIR
+
+# Columns of a keyword result, in display order
+RESULT_COLUMNS = ['Keywords', 'Intent', 'NER Entities', 'Google Content Topics']
+
+# Columnar keyword results with per-intent row indexes and per-column sort orders,
+# computed once at processing time so table interactions only touch one page
+class KeywordResultTable:
+    def __init__(self, processed_data, stats=None):
+        # Request stats, including per-stage timings, kept with the job for inspection
+        self.stats = stats or {}
+        self.columns = {}
+        for name in RESULT_COLUMNS:
+            values = np.empty(len(processed_data[name]), dtype=object)
+            values[:] = processed_data[name]
+            self.columns[name] = values
+        intents = self.columns['Intent']
+        self.intent_rows = {intent: np.flatnonzero(intents == intent) for intent in dict.fromkeys(intents.tolist())}
+        self.sort_orders = {name: np.argsort(values, kind='stable') for name, values in self.columns.items()}
+        # Aggregates read by the chart and dropdown callbacks
+        self.intents = list(self.intent_rows)
+        self.intent_counts = dict(sorted(((intent, len(rows)) for intent, rows in self.intent_rows.items()), key=lambda item: -item[1]))
+
+    def __len__(self):
+        return len(self.columns['Keywords'])
+
+    # Row indices for an intent, filtered by (column, operator, value) triples and sorted
+    def query(self, intent=None, filters=(), sort_by=None):
+        rows = self.intent_rows.get(intent, np.array([], dtype=np.intp)) if intent is not None else np.arange(len(self))
+        for column, operator, value in filters:
+            if column not in self.columns:
+                continue
+            needle = str(value).lower()
+            cells = (str(cell).lower() for cell in self.columns[column][rows])
+            if operator == 'contains':
+                keep = [needle in cell for cell in cells]
+            elif operator == 'eq':
+                keep = [needle == cell for cell in cells]
+            else:
+                keep = [needle != cell for cell in cells]
+            rows = rows[np.array(keep, dtype=bool)] if len(rows) else rows
+        if sort_by and sort_by[0].get('column_id') in self.columns:
+            order = self.sort_orders[sort_by[0]['column_id']]
+            if sort_by[0].get('direction') == 'desc':
+                order = order[::-1]
+            selected = np.zeros(len(self), dtype=bool)
+            selected[rows] = True
+            rows = order[selected[order]]
+        return rows
+
+    def records(self, rows):
+        return [{name: values[i] for name, values in self.columns.items()} for i in rows]
+
+# Server-side result store: finished jobs are kept here and the browser only holds
+# the job ID. Results are written through to disk because jobs may run on a Celery
+# worker or another web process; an in-memory LRU in front of the disk tier serves repeat reads.
+RESULT_STORE_SIZE = int(os.environ.get('KEYINTENT_RESULT_STORE_SIZE', '16'))
+RESULT_STORE_TTL = int(os.environ.get('KEYINTENT_RESULT_STORE_TTL', str(24 * 3600)))
+RESULT_STORE_DIR = os.path.join(CACHE_DIR, 'results')
+
+class ResultStore:
+    job_id_pattern = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, directory=RESULT_STORE_DIR, max_size=RESULT_STORE_SIZE, ttl=RESULT_STORE_TTL):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.pkl")
+
+    def put(self, result):
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(job_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(job_id))
+        self._remember(job_id, result)
+        self.expire()
+        return job_id
+
+    def get(self, job_id):
+        if not isinstance(job_id, str) or not self.job_id_pattern.match(job_id):
+            return None
+        with self._lock:
+            if job_id in self._entries:
+                self._entries.move_to_end(job_id)
+                return self._entries[job_id]
+        try:
+            with open(self._path(job_id), 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        self._remember(job_id, result)
+        return result
+
+    def _remember(self, job_id, result):
+        with self._lock:
+            self._entries[job_id] = result
+            self._entries.move_to_end(job_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Delete results older than the TTL from the disk tier
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    with self._lock:
+                        self._entries.pop(name.split('.')[0], None)
+            except OSError:
+                pass